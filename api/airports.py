@@ -0,0 +1,38 @@
+import time
+from typing import Dict, Iterable, Optional
+
+from models import Airport
+
+
+class AirportIndex:
+    """
+    The airports of the airportdata table by ICAO and IATA code, so routes can be enriched with
+    airport names, coordinates and countries without any queries.
+    """
+
+    # The table is filled by imports that run in another process, so reload it now and then.
+    max_age = 3600.0
+
+    def __init__(self, airports: Iterable[Airport]) -> None:
+        self.by_icao: Dict[str, Airport] = {}
+        self.by_iata: Dict[str, Airport] = {}
+        self.loaded_at = time.monotonic()
+
+        for airport in airports:
+            self.by_icao[airport.icao] = airport
+            if airport.iata:
+                self.by_iata[airport.iata] = airport
+
+    def __len__(self) -> int:
+        return len(self.by_icao)
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.loaded_at > self.max_age
+
+    def get(self, icao: Optional[str] = None, iata: Optional[str] = None) -> Optional[Airport]:
+        """Returns an airport by its ICAO code, or by its IATA code if the ICAO code is unknown."""
+        airport = self.by_icao.get(icao) if icao else None
+        if airport is None and iata:
+            airport = self.by_iata.get(iata)
+
+        return airport
@@ -1,17 +1,21 @@
 import os
-import random
 from collections import Counter
-from typing import Any, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Optional
 
 import crud
-import requests
+from batch_session import BatchSession
 from conversion import (
     aviationstack_aircraft_to_aircraft,
     aviationstack_airline_to_airline,
     aviationstack_flight_to_aircraft,
+    aviationstack_flight_to_airports,
     aviationstack_flight_to_route,
 )
+from http_client import http_client
+from key_pool import KeyPool
 from logger import get_logger
+from models import Aircraft, Airline, Airport, Route, WorkKind
 from pydantic.error_wrappers import ValidationError
 from responses import (
     AviationStackAircraftResponse,
@@ -20,6 +24,8 @@ from responses import (
 )
 
 AVIATIONSTACK_KEY = str(os.getenv('AVIATIONSTACK_KEY')).split(',')
+# Requests per key per month, 100 on the free plan.
+AVIATIONSTACK_MONTHLY_LIMIT = int(os.getenv('AVIATIONSTACK_MONTHLY_LIMIT', '100'))
 
 
 class AviationStack:
@@ -29,15 +35,28 @@ class AviationStack:
         self.adsbdata = data
         self.db = data.db
         self.config = data.config
+        self.key_pool = KeyPool(
+            AVIATIONSTACK_KEY, self.config.aviationstack_keys_path, AVIATIONSTACK_MONTHLY_LIMIT
+        )
 
     def _send_request(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
-        access_key = random.choice(AVIATIONSTACK_KEY)
+        access_key = self.key_pool.acquire()
+        if access_key is None:
+            self.logger.warning('All Aviationstack keys are used up for this month')
+            return {}
+
         all_params = {
             **params,
             'access_key': access_key,
         }
 
-        api_response = requests.get(f'http://api.aviationstack.com/v1/{endpoint}', all_params)
+        # A 429 is the usage_limit_reached of the key, retrying it would only count against
+        # the exhausted key again.
+        api_response = http_client.get(
+            f'http://api.aviationstack.com/v1/{endpoint}',
+            params=all_params,
+            retry_statuses=http_client.retry_statuses - {429},
+        )
         json_response = dict(api_response.json())
 
         if not api_response.ok:
@@ -46,7 +65,7 @@ class AviationStack:
                 and 'code' in json_response['error']
                 and json_response['error']['code'] == 'usage_limit_reached'
             ):
-                del AVIATIONSTACK_KEY[AVIATIONSTACK_KEY.index(access_key)]
+                self.key_pool.mark_exhausted(access_key)
             else:
                 self.logger.error(api_response.content)
 
@@ -54,6 +73,64 @@ class AviationStack:
 
         return json_response
 
+    def _get_pages(
+        self, endpoint: str, params: Dict[str, Any], pagination: int = 100
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the pages of an endpoint in order. The first page tells the total, the other pages
+        are fetched concurrently in waves of one page per connection, as far as the keys have
+        requests left this month. Pages that could not be fetched are logged.
+        """
+        first_page = self._send_request(endpoint, {**params, 'offset': 0})
+        if first_page == {}:
+            return
+
+        yield first_page
+
+        page_info: Dict[str, Any] = first_page.get('pagination') or {}
+        page_total: Any = page_info.get('total')
+        try:
+            total = int(page_total)
+        except (TypeError, ValueError):
+            self.logger.error(f'First page of {endpoint} has no pagination total')
+            return
+
+        offsets = list(range(pagination, total, pagination))
+        remaining = self.key_pool.get_remaining()
+
+        if len(offsets) > remaining:
+            self.logger.warning(
+                f'Only {remaining} of {len(offsets)} pages of {endpoint} fit in the quota'
+            )
+            offsets = offsets[:remaining]
+
+        wave = http_client.max_connections
+        missing = []
+
+        # Only one wave is in flight at a time, so closing the generator early does not leave
+        # requests running that count against the quota.
+        with ThreadPoolExecutor(max_workers=wave) as executor:
+            for start in range(0, len(offsets), wave):
+                wave_offsets = offsets[start : start + wave]
+                pages = list(
+                    executor.map(
+                        lambda offset: self._send_request(endpoint, {**params, 'offset': offset}),
+                        wave_offsets,
+                    )
+                )
+
+                for offset, page in zip(wave_offsets, pages):
+                    if page == {}:
+                        missing.append(offset)
+                    else:
+                        yield page
+
+        if missing:
+            self.logger.error(
+                f'Missing {len(missing)} pages of {endpoint} at offsets '
+                f'{", ".join(map(str, missing))}'
+            )
+
     def get_flights_by_icao(
         self, *, airline_icao: Optional[str] = None, flight_icao: Optional[str] = None
     ) -> None:
@@ -61,121 +138,111 @@ class AviationStack:
         Collects all current flights from Aviationstack and stores them in the db.
         Either filters on airline icao or flight icao.
         """
-        pagination = 100
-        total = pagination
-        i = 0
-
-        while i < total:
-            self.logger.info(f'Collecting Aviationstack flights for {airline_icao}: {i} / {total}')
-            params: Dict[str, Any] = {'offset': i}
-
-            if airline_icao is not None:
-                params['airline_icao'] = airline_icao
-            if flight_icao is not None:
-                params['flight_icao'] = flight_icao
-
-            api_response = self._send_request('flights', params)
-
-            if api_response == {}:
-                return
-
-            try:
-                flights: AviationStackFlightResponse = AviationStackFlightResponse.parse_obj(
-                    api_response
+        params: Dict[str, Any] = {}
+        if airline_icao is not None:
+            params['airline_icao'] = airline_icao
+        if flight_icao is not None:
+            params['flight_icao'] = flight_icao
+
+        with BatchSession(self.db) as batch:
+            for api_response in self._get_pages('flights', params):
+                try:
+                    flights: AviationStackFlightResponse = AviationStackFlightResponse.parse_obj(
+                        api_response
+                    )
+                except ValidationError as e:
+                    self.logger.error(e)
+                    raise
+
+                self.logger.info(
+                    f'Collecting Aviationstack flights for {airline_icao}: '
+                    f'{flights.pagination.offset} / {flights.pagination.total}'
                 )
-                total = flights.pagination.total
-            except ValidationError as e:
-                self.logger.error(e)
-                raise
-
-            for _, flight in enumerate(flights):
-                crud.update_route(self.db, aviationstack_flight_to_route(flight))
-                if flight.aircraft:
-                    crud.update_aircraft(self.db, aviationstack_flight_to_aircraft(flight))
 
-            i += pagination
+                batch.add(
+                    Route,
+                    [aviationstack_flight_to_route(x) for x in flights if x.flight.icao],
+                    ['icao'],
+                )
+                batch.add(
+                    Aircraft,
+                    [aviationstack_flight_to_aircraft(x) for x in flights if x.aircraft],
+                    ['icao'],
+                )
+                batch.add(
+                    Airport,
+                    [y for x in flights for y in aviationstack_flight_to_airports(x)],
+                    ['icao'],
+                    preserve_existing=True,
+                )
 
     def store_missing_flight_data(self) -> None:
         self.logger.info('Storing missing flight data from aviationstack...')
         max_items = 10
-        rows_to_delete = []
-
-        with open(self.config.routes_to_update_path, 'r') as f:
-            lines = [x.strip() for x in f.readlines()]
-            airlines = [x[:3] for x in lines]
-            top_airlines = Counter(airlines).most_common(max_items)
-            max_items = len(top_airlines)
 
-        for i in range(max_items):
-            airline_icao = top_airlines[i][0]
+        routes = [x.key for x in crud.get_pending_work_items(self.db, WorkKind.route)]
+        top_airlines = Counter([x[:3] for x in routes]).most_common(max_items)
 
-            for j, l in enumerate(lines):
-                if l.startswith(airline_icao):
-                    rows_to_delete.append(l)
-
-            self.logger.info(f'{airline_icao} {i} / {max_items}')
+        for i, (airline_icao, _) in enumerate(top_airlines):
+            self.logger.info(f'{airline_icao} {i} / {len(top_airlines)}')
             self.get_flights_by_icao(airline_icao=airline_icao)
 
-        # Delete flights that could not be found.
-        lines = [x for x in lines if x not in rows_to_delete and x != '']
-        with open(self.config.routes_to_update_path, 'w') as fw:
-            fw.write('\n'.join(lines) + '\n')
+            attempted = [x for x in routes if x.startswith(airline_icao)]
+            crud.resolve_work_items(self.db)
+            crud.record_work_attempts(self.db, WorkKind.route, attempted, 'aviationstack')
 
         self.logger.info('Missing flight data from aviationstack is stored.')
 
     def store_airlinedata(self) -> None:
         self.logger.info('Storing airline data from aviationstack...')
-        total = 1e8
-        pagination = 100
-        i = 0
-
-        while i < total:
-            params = {
-                'offset': i,
-            }
-            api_response = self._send_request('airlines', params)
-
-            for a in api_response['data']:
-                if not a['airline_name']:
-                    self.logger.debug(a)
-
-            airlines: AviationStackAirlineResponse = AviationStackAirlineResponse.parse_obj(
-                api_response
-            )
-            total = airlines.pagination.total
-            self.logger.info(f'Aviationstack airlines: {i} / {total}')
 
-            for airline in airlines:
-                self.logger.debug(airline)
-                if airline.airline_name:
-                    crud.update_airline(self.db, aviationstack_airline_to_airline(airline))
+        with BatchSession(self.db) as batch:
+            for api_response in self._get_pages('airlines', {}):
+                for a in api_response['data']:
+                    if not a['airline_name']:
+                        self.logger.debug(a)
+
+                airlines: AviationStackAirlineResponse = AviationStackAirlineResponse.parse_obj(
+                    api_response
+                )
+                self.logger.info(
+                    f'Aviationstack airlines: '
+                    f'{airlines.pagination.offset} / {airlines.pagination.total}'
+                )
 
-            i += pagination
+                batch.add(
+                    Airline,
+                    [
+                        aviationstack_airline_to_airline(x)
+                        for x in airlines
+                        if x.airline_name and x.iata_code
+                    ],
+                    ['iata_code'],
+                )
 
         self.logger.info('Aircraft data from aviationstack is stored.')
 
     def store_aircraftdata(self) -> None:
         self.logger.info('Storing aircraft from aviationstack...')
-        total = 1e8
-        pagination = 100
-        i = 0
-
-        while i < total:
-            params = {'offset': i}
-            api_response = self._send_request('airplanes', params)
-            aircraft_list: AviationStackAircraftResponse = AviationStackAircraftResponse.parse_obj(
-                api_response
-            )
-            total = aircraft_list.pagination.total
-            self.logger.info(f'Aviationstack aircraft: {i} / {total}')
 
-            for as_aircraft in aircraft_list:
-                if as_aircraft.icao_code_hex is None:
-                    continue
-
-                db_aircraft = aviationstack_aircraft_to_aircraft(self.adsbdata, as_aircraft)
-                crud.update_aircraft(self.db, db_aircraft)
+        with BatchSession(self.db) as batch:
+            for api_response in self._get_pages('airplanes', {}):
+                aircraft_list: AviationStackAircraftResponse = (
+                    AviationStackAircraftResponse.parse_obj(api_response)
+                )
+                self.logger.info(
+                    f'Aviationstack aircraft: '
+                    f'{aircraft_list.pagination.offset} / {aircraft_list.pagination.total}'
+                )
 
-            i += pagination
+                batch.add(
+                    Aircraft,
+                    [
+                        aviationstack_aircraft_to_aircraft(self.adsbdata, x)
+                        for x in aircraft_list
+                        if x.icao_code_hex is not None
+                    ],
+                    ['icao'],
+                )
 
         self.logger.info('Aircraft data from aviationstack is stored.')
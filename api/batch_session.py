@@ -0,0 +1,101 @@
+import time
+from types import TracebackType
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+import crud
+from logger import get_logger
+from sqlalchemy.orm.session import Session
+
+BatchKey = Tuple[Any, Tuple[str, ...], bool]
+
+
+class BatchSession:
+    """
+    Collects the rows that a collector writes and upserts them in batches, so an import is one
+    transaction instead of one per row.
+
+    Pending rows are written every `batch_size` rows or `flush_interval` seconds, each batch in
+    its own SAVEPOINT. The interval is only checked when rows are added, so rows stay pending
+    while a collector adds nothing, until the next add or flush. A batch that fails is rolled
+    back and logged without losing the batches before it. Everything is committed once when the
+    context manager exits, or rolled back when the block raised.
+
+        with BatchSession(db) as batch:
+            batch.add(Route, routes, ['icao'])
+    """
+
+    logger = get_logger('batch_session')
+
+    def __init__(self, db: Session, batch_size: int = 1000, flush_interval: float = 5.0) -> None:
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.result = crud.UpsertResult()
+        self.failed = 0
+        self._pending: Dict[BatchKey, List[Any]] = {}
+        self._pending_count = 0
+        self._flushed_at = time.monotonic()
+
+    def __enter__(self) -> 'BatchSession':
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        # The exception propagates after the rollback, the caller decides whether to retry.
+        if exc_type is not None:
+            self._pending = {}
+            self._pending_count = 0
+            self.db.rollback()
+            return
+
+        self.flush()
+        self.db.commit()
+
+        if self.failed:
+            self.logger.error(f'{self.failed} rows could not be stored')
+
+    def add(
+        self,
+        model: Any,
+        rows: Iterable[Any],
+        conflict_key: Sequence[str],
+        preserve_existing: bool = False,
+    ) -> None:
+        """Queues rows (dicts of column values or model instances) for crud.bulk_upsert."""
+        rows = list(rows)
+        self._pending.setdefault((model, tuple(conflict_key), preserve_existing), []).extend(rows)
+        self._pending_count += len(rows)
+
+        if (
+            self._pending_count >= self.batch_size
+            or time.monotonic() - self._flushed_at >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        for (model, conflict_key, preserve_existing), rows in self._pending.items():
+            try:
+                with self.db.begin_nested():
+                    result = crud.bulk_upsert(
+                        self.db,
+                        model,
+                        rows,
+                        conflict_key,
+                        batch_size=self.batch_size,
+                        preserve_existing=preserve_existing,
+                        commit=False,
+                    )
+            except Exception:
+                self.logger.exception(f'Could not store a batch of {len(rows)} {model.__name__}')
+                self.failed += len(rows)
+                continue
+
+            self.result = crud.UpsertResult(*(a + b for a, b in zip(self.result, result)))
+
+        self._pending = {}
+        self._pending_count = 0
+        self._flushed_at = time.monotonic()
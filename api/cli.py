@@ -2,14 +2,21 @@ import sys
 import time
 
 import click
+import crud
 import models
 from collector import DataSource
 from config import Config
 from data import ADSBData
-from database import SessionLocal, engine
+from database import (
+    Base,
+    SessionLocal,
+    create_database_engine,
+    create_tables,
+)
 from logger import get_logger
+from sqlalchemy.orm import Session
 
-models.Base.metadata.create_all(bind=engine)
+create_tables()
 
 
 config = Config()
@@ -44,7 +51,30 @@ def load_data_source(source: str) -> None:
         data.collector.load_data(DataSource(source))
 
 
+@click.command()
+@click.option(
+    "--target",
+    required=True,
+    help="URL of the database to copy all data to, e.g. sqlite:///data/web1090.db.",
+)
+def migrate_data(target: str) -> None:
+    target_engine = create_database_engine(target)
+    create_tables(target_engine)
+
+    with SessionLocal() as source_db, Session(target_engine) as target_db:
+        for table in Base.metadata.sorted_tables:
+            model = next(
+                mapper.class_ for mapper in Base.registry.mappers if mapper.local_table is table
+            )
+            started = time.monotonic()
+            copied = crud.copy_table(source_db, target_db, model)
+            logger.info(
+                f'Copied {copied} rows of {table.name} in {time.monotonic() - started:.0f}s'
+            )
+
+
 if __name__ == "__main__":
     cli.add_command(track_aircraft)
     cli.add_command(load_data_source)
+    cli.add_command(migrate_data)
     cli()
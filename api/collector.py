@@ -5,24 +5,46 @@ import json
 import os
 import shutil
 import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
-from typing import Any, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import crud
 import models
-import requests
 from aviationstack import AviationStack
-from conversion import virtualradar_route_to_route
+from batch_session import BatchSession
+from conversion import (
+    virtualradar_row_to_airport_values,
+    virtualradar_row_to_route_values,
+)
 from dotenv import load_dotenv
 from google import Google
+from http_client import http_client
 from logger import get_logger
-from responses import VirtualRadarRoute
 from schiphol import Schiphol
 from sqlalchemy.orm.session import Session
 
 load_dotenv()
 
 
+def read_piaware_shard(json_file: str) -> List[Tuple[str, str]]:
+    """
+    Returns the icao and type of the aircraft in a shard of the piaware database. The keys of a
+    shard are the icao codes without the prefix that is the name of the file.
+    """
+    prefix = os.path.splitext(os.path.basename(json_file))[0]
+
+    with open(json_file, 'r') as f:
+        data = json.load(f)
+
+    return [
+        (f'{prefix}{key}'.upper(), ac['t'])
+        for key, ac in data.items()
+        if key != 'children' and ac.get('t')
+    ]
+
+
 class DataSource(str, Enum):
     opensky = "opensky"
     flightaware = "flightaware"
@@ -34,6 +56,7 @@ class DataSource(str, Enum):
     google_missing_aircraft = 'google.missing_aircraft'
     virtualradar = "virtualradar"
     piaware_aircraft = "piaware.aircraft"
+    country_ids = "country_ids"
 
 
 class Collector:
@@ -48,12 +71,12 @@ class Collector:
     def store_routedata_virtualradar(self) -> None:
         self.logger.info('Storing routes...')
         download_url = 'https://www.virtualradarserver.co.uk/Files/StandingData.sqb.gz'
-        sqb_gz_path = 'data/virtualradar.sqb.gz'
-        sqb_path = sqb_gz_path[:-3]
+        sqb_path = self.config.virtualradar_sqb_path
+        sqb_gz_path = f'{sqb_path}.gz'
 
         if not os.path.exists(sqb_path):
             self.logger.info('Downloading sqb...')
-            response = requests.get(download_url, stream=True)
+            response = http_client.get(download_url, stream=True)
             with open(sqb_gz_path, 'wb') as f:
                 for chunk in response:
                     f.write(chunk)
@@ -67,29 +90,70 @@ class Collector:
 
         conn = sqlite3.connect(sqb_path)
         conn.row_factory = sqlite3.Row
+        total = conn.execute('select count(*) from RouteView').fetchone()[0]
         cur_in = conn.execute('select * from RouteView ORDER BY RouteId desc')
-        aggregated_route_data = []
-        routes = cur_in.fetchall()
+        get_country_id = self.config.country_resolver.resolve
+        batch_size = 5000
+        airports: Dict[str, Dict[str, Any]] = {}
+        stored = 0
+        started = time.monotonic()
+
+        with BatchSession(self.get_db(), batch_size=batch_size) as batch:
+            while True:
+                vr_routes = cur_in.fetchmany(batch_size)
+                if not vr_routes:
+                    break
+
+                routes = [virtualradar_row_to_route_values(x, get_country_id) for x in vr_routes]
+                batch.add(models.Route, routes, ['icao'])
+
+                for vr_route in vr_routes:
+                    for prefix in ('From', 'To'):
+                        icao = vr_route[f'{prefix}AirportIcao']
+                        if icao and icao not in airports:
+                            airports[icao] = virtualradar_row_to_airport_values(
+                                vr_route, prefix, get_country_id
+                            )
+
+                stored += len(vr_routes)
+                self.logger.info(
+                    f'Progress: {stored} / {total} ({stored / max(total, 1) * 100:.0f}%), '
+                    f'{stored / (time.monotonic() - started):.0f} routes/s'
+                )
 
-        for i, vr_route in enumerate(routes):
-            if i % int(len(routes) / 100) == 0:
-                self.logger.info(f'Progress: {i} / {len(routes)} ({i/len(routes)*100:.0f}%)')
+            batch.add(models.Airport, airports.values(), ['icao'])
 
-            route = VirtualRadarRoute.parse_obj(vr_route)
-            route.FromAirportCountryId = self.adsbdata.get_country_id(route.FromAirportCountry)
-            route.ToAirportCountryId = self.adsbdata.get_country_id(route.ToAirportCountry)
+        self.config.airport_index = None
+        self.logger.info(f'Finished loading routes and {len(airports)} airports.')
+        conn.close()
 
-            crud.update_route(self.get_db(), virtualradar_route_to_route(route))
-            aggregated_route_data.append(route)
+    def store_country_ids(self) -> None:
+        """Resolves every known country name once and persists the results."""
+        names = set(self.config.country_aliases.keys())
+        names |= {str(r['country']) for r in self.config.ac_countries}
 
-        self.logger.info('Finished loading routes.')
-        conn.close()
+        if os.path.exists(self.config.virtualradar_sqb_path):
+            conn = sqlite3.connect(self.config.virtualradar_sqb_path)
+            cur_in = conn.execute(
+                'select distinct FromAirportCountry from RouteView '
+                'union select distinct ToAirportCountry from RouteView'
+            )
+            names |= {row[0] for row in cur_in if row[0]}
+            conn.close()
+
+        unresolved = self.config.country_resolver.build(names)
+        self.logger.info(
+            f'Resolved {len(names) - unresolved} / {len(names)} country names, '
+            f'could not resolve: {", ".join(self.config.country_resolver.get_unresolved())}'
+        )
 
     def load_data(self, source: DataSource) -> None:
-        self.update_csvs()
+        self.update_work_queue()
 
         if source == DataSource.opensky:
             self.store_aircraftdata_opensky()
+        elif source == DataSource.flightaware:
+            self.store_aircraftdata_flightaware()
         elif source == DataSource.aviationstack_aircraft:
             aviationstack = AviationStack(self.adsbdata)
             aviationstack.store_aircraftdata()
@@ -112,47 +176,62 @@ class Collector:
             self.store_routedata_virtualradar()
         elif source == DataSource.piaware_aircraft:
             self.store_aircraftdata_piaware()
+        elif source == DataSource.country_ids:
+            self.store_country_ids()
         else:
             self.logger.error(f'invalid source: {source}')
 
-    def update_csvs(self) -> None:
-        with open(self.config.routes_to_update_path, 'r') as f:
-            text = f.read()
-            lines = text.split('\n')
+        # Persist the country names that were resolved for the first time during this import.
+        self.config.country_resolver.save()
 
-        lines = [x for x in lines if crud.get_route(self.get_db(), x) is None and x.strip() != '']
-        with open(self.config.routes_to_update_path, 'w') as fw:
-            fw.write('\n'.join(lines) + '\n')
+    def update_work_queue(self) -> None:
+        self.import_work_lists()
+        crud.resolve_work_items(self.get_db())
 
-        with open(self.config.aircraft_to_update_path, 'r') as f:
-            text = f.read()
-            lines = text.split('\n')
+    def import_work_lists(self) -> None:
+        """Moves the csv work lists of older versions into the work queue."""
+        for kind, path in (
+            (models.WorkKind.route, self.config.routes_to_update_path),
+            (models.WorkKind.aircraft, self.config.aircraft_to_update_path),
+        ):
+            if not os.path.exists(path):
+                continue
 
-        lines = [
-            x.strip()
-            for x in lines
-            if (' ' not in x or crud.get_aircraft(self.get_db(), x.split(' ')[0]) is None)
-            and x.strip() != ''
-        ]
-        with open(self.config.aircraft_to_update_path, 'w') as fw:
-            fw.write('\n'.join(lines) + '\n')
+            with open(path, 'r') as f:
+                lines = [x.split(' ') for x in f.read().split('\n') if x.strip() != '']
+
+            items = [(x[0], x[1] if len(x) > 1 else None) for x in lines]
+            crud.enqueue_work_items(self.get_db(), kind, items)
+            os.rename(path, f'{path}.imported')
+            self.logger.info(f'Imported {len(items)} {kind.value} work items from {path}')
 
     def store_aircraftdata_piaware(self) -> None:
+        self.logger.info('Storing aircraft data from piaware...')
         json_files = glob.glob(self.config.piaware_ac_db_path + '/*.json')
         json_files.sort()
+        stored = 0
+        started = time.monotonic()
+
+        # Parsing the shards is CPU-bound, so it runs in a process per core.
+        with ProcessPoolExecutor() as executor, BatchSession(
+            self.get_db(), batch_size=5000
+        ) as batch:
+            shards = executor.map(read_piaware_shard, json_files, chunksize=8)
+
+            for i, shard in enumerate(shards, 1):
+                batch.add(
+                    models.Aircraft,
+                    ({'icao': icao, 'aircrafttype': ac_type} for icao, ac_type in shard),
+                    ['icao'],
+                )
 
-        for i, json_file in enumerate(json_files):
-            print(f'{i} / {len(json_files)}: {json_file}')
-            with open(json_file, 'r') as f:
-                data = json.load(f)
-                for icao, ac in data.items():
-                    if 't' not in ac or not ac['t']:
-                        continue
+                stored += len(shard)
+                self.logger.info(
+                    f'Progress: {i} / {len(json_files)} files, {stored} aircraft, '
+                    f'{stored / (time.monotonic() - started):.0f} aircraft/s'
+                )
 
-                    aircraft = models.Aircraft(icao=icao, aircrafttype=ac['t'])
-                    result = crud.update_aircraft(self.get_db(), aircraft)
-                    if result:
-                        print(icao, '\t', ac['t'])
+        self.logger.info('Aircraft data is stored.')
 
     def store_aircraftdata_opensky(self) -> None:
         self.logger.info('Storing aircraft data from opensky...')
@@ -160,7 +239,7 @@ class Collector:
 
         if not os.path.exists(self.config.opensky_csv_path):
             self.logger.info(f'Downloading {download_url}...')
-            response = requests.get(download_url, stream=True)
+            response = http_client.get(download_url, stream=True)
 
             with open(self.config.opensky_csv_path, 'wb') as f:
                 for chunk in response:
@@ -171,100 +250,160 @@ class Collector:
         def verify_date(date: str) -> Optional[str]:
             return None if len(date) < 6 else date
 
-        with open(self.config.opensky_csv_path, 'r', newline='') as csv_file:
-            reader = csv.DictReader(csv_file, delimiter=',')
-
-            for row in reader:
-                icao = row['icao24'].upper()
-                if len(icao) != 6:
-                    continue
-                ac_type = row['typecode']
+        # The date columns of aircraftdata are of type time, which cannot hold the dates
+        # in this csv, so they are not loaded.
+        columns = [
+            'icao',
+            'registration',
+            'aircrafttype',
+            'category',
+            'country',
+            'family',
+            'airline_iata',
+            'plane_owner',
+            'model_name',
+            'model_code',
+            'production_line',
+        ]
+        # Only set for new aircraft.
+        insert_only_columns = ['has_no_images', 'active', 'favorite', 'needs_update']
 
-                country = self.adsbdata.get_country(icao)
-                category = self.adsbdata.get_category(ac_type)
-                family = self.adsbdata.get_family(ac_type)
+        db = self.get_db()
+        # Without COPY (SQLite) every batch is upserted right away, with the same result.
+        use_copy = crud.supports_copy(db)
+        staging_table = crud.create_staging_table(db, models.Aircraft) if use_copy else ''
+        loaded = 0
+        started = time.monotonic()
 
-                aircraft = models.Aircraft(
-                    icao=icao,
-                    registration=row['registration'],
-                    aircrafttype=ac_type,
-                    category=category,
-                    country=country,
-                    family=family,
-                    airline_iata=row['operatoriata'],
-                    plane_owner=row['owner'],
-                    model_name=row['model'],
-                    model_code=ac_type,
-                    production_line=verify_date(row['linenumber']),
-                    delivery_date=verify_date(row['built']),
-                    registration_date=verify_date(row['registered']),
-                    rollout_date=verify_date(row['firstflightdate']),
-                )
+        with open(self.config.opensky_csv_path, 'r', newline='') as csv_file:
+            reader = csv.DictReader(csv_file, delimiter=',')
 
-                has_been_created = crud.update_aircraft(self.get_db(), aircraft)
+            for batch in crud.chunked(reader, 20000):
+                batch = [row for row in batch if len(row['icao24']) == 6]
+                icaos = [row['icao24'].upper() for row in batch]
+                ac_types = [row['typecode'] for row in batch]
+                countries = self.adsbdata.get_countries(icaos)
+                categories = [self.adsbdata.get_category(x) for x in ac_types]
+                families = [self.adsbdata.get_family(x) for x in ac_types]
+
+                rows = [
+                    (
+                        icao,
+                        row['registration'],
+                        ac_type,
+                        category,
+                        country,
+                        family,
+                        row['operatoriata'],
+                        row['owner'],
+                        row['model'],
+                        ac_type,
+                        verify_date(row['linenumber']),
+                        False,
+                        False,
+                        False,
+                        False,
+                    )
+                    for row, icao, ac_type, country, category, family in zip(
+                        batch, icaos, ac_types, countries, categories, families
+                    )
+                ]
+                if use_copy:
+                    crud.copy_into_table(db, staging_table, columns + insert_only_columns, rows)
+                else:
+                    crud.bulk_upsert(
+                        db,
+                        models.Aircraft,
+                        [dict(zip(columns + insert_only_columns, row)) for row in rows],
+                        ['icao'],
+                        update_columns=columns[1:],
+                        batch_size=5000,
+                        commit=False,
+                    )
+
+                loaded += len(rows)
                 self.logger.info(
-                    'Added' if has_been_created else 'Updated' + f' {row["registration"]}...'
+                    f'Loaded {loaded} aircraft, '
+                    f'{loaded / (time.monotonic() - started):.0f} aircraft/s'
                 )
 
-        self.logger.info('finished')
+        merged = loaded
+        if use_copy:
+            self.logger.info('Merging aircraft into aircraftdata...')
+            merged = crud.merge_staging_table(
+                db,
+                models.Aircraft,
+                staging_table,
+                columns + insert_only_columns,
+                update_columns=columns[1:],
+                index_elements=['icao'],
+            )
+        db.commit()
+        self.config.cached_aircraft.clear()
 
-    def store_aircraftdata_flightaware(self) -> None:
-        self.logger.info('Storing aircraft data in postgres...')
+        self.logger.info(f'Finished, stored {merged} aircraft in {time.monotonic() - started:.0f}s')
 
-        with open('data/flightaware.csv', 'r') as f:
+    def read_aircraftdata_flightaware(self) -> Iterator[Dict[str, Any]]:
+        with open(self.config.flightaware_csv_path, 'r', newline='') as f:
             reader = csv.reader(f, delimiter=',')
-            aggregated_data = []
 
             # Skip header
             next(reader, None)
 
-            for i, aircraft in enumerate(reader):
-                if i % 10000 == 0:
-                    self.logger.info(f'Progress: {i}')
-
-                icao = aircraft[0].upper()
-                reg = aircraft[1]
-                ac_type = aircraft[2]
-
-                country = self.adsbdata.get_country(icao)
-                category = self.adsbdata.get_category(ac_type)
-                family = self.adsbdata.get_family(ac_type)
-
-                aggregated_data.append(
-                    {
-                        'icao': icao,
-                        'registration': reg,
-                        'aircrafttype': ac_type,
-                        'country': country,
-                        'category': category,
-                        'family': family,
-                        'favorite': False,
-                        'needs_update': False,
-                        'airline_iata': None,
-                        'plane_owner': None,
-                        'model_name': None,
-                        'model_code': None,
-                        'production_line': None,
-                        'delivery_date': None,
-                        'first_flight_date': None,
-                        'registration_date': None,
-                        'rollout_date': None,
-                        'active': None,
-                    }
+            for aircraft in reader:
+                if len(aircraft) < 3 or len(aircraft[0]) != 6:
+                    continue
+
+                yield {
+                    'icao': aircraft[0].upper(),
+                    'registration': aircraft[1] or None,
+                    'aircrafttype': aircraft[2] or None,
+                }
+
+    def store_aircraftdata_flightaware(self) -> None:
+        self.logger.info('Storing aircraft data from flightaware...')
+        stored = 0
+        started = time.monotonic()
+
+        with BatchSession(self.get_db(), batch_size=5000) as batch:
+            for aircraft in crud.chunked(self.read_aircraftdata_flightaware(), 5000):
+                countries = self.adsbdata.get_countries([ac['icao'] for ac in aircraft])
+
+                for ac, country in zip(aircraft, countries):
+                    ac_type = ac['aircrafttype'] or ''
+                    ac['country'] = country
+                    ac['category'] = self.adsbdata.get_category(ac_type)
+                    ac['family'] = self.adsbdata.get_family(ac_type)
+
+                # FlightAware only knows the type and registration, keep what richer sources
+                # stored.
+                batch.add(models.Aircraft, aircraft, ['icao'], preserve_existing=True)
+
+                stored += len(aircraft)
+                self.logger.info(
+                    f'Progress: {stored}, {stored / (time.monotonic() - started):.0f} aircraft/s'
                 )
 
-            self.logger.info('Aircraft data is stored.')
+        self.logger.info('Aircraft data is stored.')
 
     def get_image_id(self, icao: str, i: int) -> int:
         return int(icao, 16) * 100 + i
 
     def get_aircraft_image_data(
-        self, aircraft: models.Aircraft, icao: str
+        self,
+        aircraft: models.Aircraft,
+        icao: str,
+        images: Optional[List[models.AircraftImage]] = None,
     ) -> List[models.AircraftImage]:
+        """
+        Returns the images of an aircraft, fetching them from airport-data.com if none are stored.
+        Pass `images` when they have already been queried to avoid another lookup.
+        """
         icao = icao.upper()
 
         db = self.get_db()
-        images: List[models.AircraftImage] = crud.get_images(db, icao)
+        if images is None:
+            images = crud.get_images(db, icao)
 
         if aircraft is None:
             self.logger.debug(f'get_aircraft_image_data: {icao}')
@@ -277,7 +416,7 @@ class Collector:
 
         url = f'https://www.airport-data.com/api/ac_thumb.json?m={icao}&n={count}'
         self.logger.debug('Sending api request')
-        response = requests.get(url)
+        response = http_client.get(url)
 
         if not response.ok:
             crud.set_aircraft_has_no_images(db, aircraft)
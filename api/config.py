@@ -1,23 +1,51 @@
 import json
 from datetime import datetime
 from logging import Logger
-from typing import Any, Dict
+from typing import Optional
+
+from airports import AirportIndex
+from countries import CountryIndex, CountryResolver
+from dump1090 import DUMP1090Client
+from jobs import BackgroundJobs
+from lookup_cache import TTLCache, aircraft_cache, route_cache
+from models import Aircraft, Route
+from search import SearchIndex
 
 
 class Config:
     def __init__(self) -> None:
-        self.cached_routes: Dict[str, Any] = {}
-        self.cached_aircraft: Dict[str, Any] = {}
-        self.country_ids: Dict[str, str] = {}
+        self.cached_routes: TTLCache[Route] = route_cache
+        self.cached_aircraft: TTLCache[Aircraft] = aircraft_cache
+        self.country_index: Optional[CountryIndex] = None
+        self.airport_index: Optional[AirportIndex] = None
+        self.search_index: Optional[SearchIndex] = None
+        self.dump1090 = DUMP1090Client()
+        self.background_jobs = BackgroundJobs()
         self.ac_logos_path = 'data/logos'
+        # Expires, so a long running process also counts the logos that other processes download.
+        self.airline_logo_count: TTLCache[int] = TTLCache(max_size=1, ttl=600, negative_ttl=600)
+        # Work lists of older versions, imported into the work queue once.
         self.aircraft_to_update_path = 'data/aircraft_to_update.csv'
         self.routes_to_update_path = 'data/routes_to_update.csv'
+        # Expires, so failed items are enqueued (and retried) again by a long running process.
+        self.enqueued_work_items: TTLCache[bool] = TTLCache(
+            max_size=100000, ttl=3600, negative_ttl=3600
+        )
         self.opensky_csv_path = 'data/opensky.csv'
+        self.flightaware_csv_path = 'data/flightaware.csv'
         self.piaware_ac_db_path = '/usr/share/dump1090-fa/html/db/'
+        self.virtualradar_sqb_path = 'data/virtualradar.sqb'
+        self.country_ids_path = 'data/country_ids.json'
+        self.aviationstack_keys_path = 'data/aviationstack_keys.json'
 
-        with open('data/country_aliases.json', 'r') as f:
+        self.country_aliases_path = 'data/country_aliases.json'
+        with open(self.country_aliases_path, 'r') as f:
             self.country_aliases = json.load(f)
 
+        self.country_resolver = CountryResolver(
+            self.country_ids_path, self.country_aliases, self.country_aliases_path
+        )
+
         with open('data/ac_icons.json', 'r') as f:
             self.ac_icons = json.load(f)
 
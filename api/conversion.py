@@ -1,6 +1,6 @@
-from typing import Any
+from typing import Any, Callable, Dict, List, Mapping, Optional
 
-from models import Aircraft, Airline, Route
+from models import Aircraft, Airline, Airport, Route
 from responses import (
     AviationStackAircraft,
     AviationStackAirline,
@@ -130,6 +130,68 @@ def virtualradar_route_to_route(vr_flight: VirtualRadarRoute) -> Route:
     )
 
 
+def virtualradar_row_to_route_values(
+    vr_row: Mapping[str, Any], get_country_id: Callable[[str], Optional[str]]
+) -> Dict[str, Any]:
+    """
+    Converts a row of the VirtualRadar RouteView to the column values of a Route.
+    Used by the bulk import, which skips the validation of VirtualRadarRoute for speed.
+    """
+    return {
+        'icao': vr_row['Callsign'],
+        'iata': None,
+        'airline_name': vr_row['OperatorName'],
+        'airline_iata': vr_row['OperatorIata'],
+        'airline_icao': vr_row['OperatorIcao'],
+        'dep_airport': vr_row['FromAirportName'],
+        'dep_icao': vr_row['FromAirportIcao'],
+        'dep_iata': vr_row['FromAirportIata'],
+        'dep_lat': vr_row['FromAirportLatitude'],
+        'dep_lon': vr_row['FromAirportLongitude'],
+        'dep_alt': vr_row['FromAirportAltitude'],
+        'dep_loc': vr_row['FromAirportLocation'],
+        'dep_country': vr_row['FromAirportCountry'],
+        'dep_country_id': get_country_id(vr_row['FromAirportCountry']),
+        'arr_airport': vr_row['ToAirportName'],
+        'arr_icao': vr_row['ToAirportIcao'],
+        'arr_iata': vr_row['ToAirportIata'],
+        'arr_lat': vr_row['ToAirportLatitude'],
+        'arr_lon': vr_row['ToAirportLongitude'],
+        'arr_alt': vr_row['ToAirportAltitude'],
+        'arr_loc': vr_row['ToAirportLocation'],
+        'arr_country': vr_row['ToAirportCountry'],
+        'arr_country_id': get_country_id(vr_row['ToAirportCountry']),
+    }
+
+
+def virtualradar_row_to_airport_values(
+    vr_row: Mapping[str, Any], prefix: str, get_country_id: Callable[[str], Optional[str]]
+) -> Dict[str, Any]:
+    """
+    Converts the departure (`prefix` 'From') or arrival ('To') airport of a row of the
+    VirtualRadar RouteView to the column values of an Airport.
+    """
+    return {
+        'icao': vr_row[f'{prefix}AirportIcao'],
+        'iata': vr_row[f'{prefix}AirportIata'],
+        'name': vr_row[f'{prefix}AirportName'],
+        'location': vr_row[f'{prefix}AirportLocation'],
+        'country': vr_row[f'{prefix}AirportCountry'],
+        'country_id': get_country_id(vr_row[f'{prefix}AirportCountry']),
+        'lat': vr_row[f'{prefix}AirportLatitude'],
+        'lon': vr_row[f'{prefix}AirportLongitude'],
+        'alt': vr_row[f'{prefix}AirportAltitude'],
+    }
+
+
+def aviationstack_flight_to_airports(as_flight: AviationStackRealTimeFlight) -> List[Airport]:
+    return [
+        Airport(icao=airport.icao, iata=airport.iata, name=airport.airport)
+        for airport in (as_flight.departure, as_flight.arrival)
+        if airport.icao
+    ]
+
+
 def google_flight_to_route(g_flight: GoogleFlightMetaTag, icao: str) -> Route:
     return Route(
         icao=icao,
@@ -0,0 +1,176 @@
+import json
+import os
+import tempfile
+from bisect import bisect_right
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pycountry
+from logger import get_logger
+
+
+class CountryResolver:
+    """
+    Resolves country names (e.g. of VirtualRadar and ac_countries.json) to ISO alpha-2 codes.
+
+    Results are kept in a table that is persisted to `path`, including the names that could not
+    be resolved, so the slow fuzzy search of pycountry runs only once per name. Those are tried
+    again by build(), and when the aliases file at `aliases_path` changed since the table was
+    saved, as a new alias might resolve them.
+    """
+
+    logger = get_logger('countries')
+
+    def __init__(
+        self, path: str, aliases: Dict[str, str], aliases_path: Optional[str] = None
+    ) -> None:
+        self.path = path
+        self.aliases = aliases
+        self.table: Dict[str, Optional[str]] = {}
+        self.dirty = False
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.table = json.load(f)
+
+            # A new alias might resolve a name that failed before.
+            aliases_changed = aliases_path is not None and (
+                os.path.getmtime(aliases_path) > os.path.getmtime(path)
+            )
+            if aliases_changed:
+                self.table = {name: id for name, id in self.table.items() if id is not None}
+                self.dirty = True
+
+            self.logger.info(
+                f'Loaded {len(self.table)} country names, '
+                f'{len(self.get_unresolved())} could not be resolved'
+            )
+
+    def resolve(self, name: str, retry_unresolved: bool = False) -> Optional[str]:
+        if name in self.table and (self.table[name] is not None or not retry_unresolved):
+            return self.table[name]
+
+        country_id = self._search(self.aliases.get(name, name))
+        if country_id is None:
+            self.logger.error(f'Error: Could not resolve country "{name}"')
+
+        self.table[name] = country_id
+        self.dirty = True
+        return country_id
+
+    @staticmethod
+    def _search(name: str) -> Optional[str]:
+        country = pycountry.countries.get(name=name)
+
+        if country is None:
+            country = pycountry.countries.get(official_name=name)
+        if country is None:
+            try:
+                country = pycountry.countries.search_fuzzy(name)[0]
+            except LookupError:
+                pass
+
+        return str(country.alpha_2) if country is not None else None
+
+    def get_unresolved(self) -> List[str]:
+        return sorted(name for name, country_id in self.table.items() if country_id is None)
+
+    def build(self, names: Iterable[str]) -> int:
+        """
+        Resolves all names that are not in the table yet or could not be resolved before,
+        returns the number of failures.
+        """
+        for name in names:
+            self.resolve(name, retry_unresolved=True)
+
+        self.save()
+        return len(self.get_unresolved())
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+
+        # The API workers and the collector save the same file, each writes its own temporary
+        # file, so the replace always puts a complete table in place.
+        with tempfile.NamedTemporaryFile(
+            'w', dir=os.path.dirname(self.path) or '.', suffix='.tmp', delete=False
+        ) as f:
+            json.dump(self.table, f, indent=2, sort_keys=True)
+
+        os.replace(f.name, self.path)
+        self.dirty = False
+
+
+class CountryIndex:
+    """
+    ICAO hex ranges of ac_countries.json, compiled into sorted non-overlapping intervals.
+
+    Some ranges (e.g. 'Unassigned (EUR / NAT regions)') contain ranges of countries. As before,
+    the range that comes first in ac_countries.json wins. The country ids are resolved once when
+    the index is built, so lookups never hit pycountry.
+    """
+
+    def __init__(
+        self, ac_countries: List[Dict[str, Any]], get_country_id: Callable[[str], Optional[str]]
+    ) -> None:
+        ranges = [(int(r['start'], 16), int(r['end'], 16)) for r in ac_countries]
+        bounds = sorted({start for start, _ in ranges} | {end + 1 for _, end in ranges})
+
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.countries: List[int] = []
+
+        for start, next_start in zip(bounds, bounds[1:]):
+            country = next(
+                (i for i, (s, e) in enumerate(ranges) if s <= start and next_start - 1 <= e),
+                None,
+            )
+            if country is None:
+                continue
+
+            if self.countries and self.countries[-1] == country and self.ends[-1] + 1 == start:
+                self.ends[-1] = next_start - 1
+            else:
+                self.starts.append(start)
+                self.ends.append(next_start - 1)
+                self.countries.append(country)
+
+        names = [str(r['country']) for r in ac_countries]
+        country_ids = {name: get_country_id(name) for name in set(names)}
+        self.country_ids: List[Optional[str]] = [country_ids[name] for name in names]
+
+    def _find(self, icao: int) -> Optional[int]:
+        i = bisect_right(self.starts, icao) - 1
+        if i < 0 or icao > self.ends[i]:
+            return None
+
+        return self.countries[i]
+
+    def lookup(self, icao: int) -> Tuple[bool, Optional[str]]:
+        """Returns whether the hex code is in a known range and the id of its country."""
+        country = self._find(icao)
+        if country is None:
+            return False, None
+
+        return True, self.country_ids[country]
+
+    def lookup_many(self, icaos: Sequence[str]) -> List[Optional[str]]:
+        """Resolves the country ids of many hex codes, invalid or unknown codes resolve to None."""
+        starts, ends, countries, country_ids = (
+            self.starts,
+            self.ends,
+            self.countries,
+            self.country_ids,
+        )
+        result: List[Optional[str]] = []
+
+        for icao in icaos:
+            try:
+                value = int(icao, 16)
+            except ValueError:
+                result.append(None)
+                continue
+
+            i = bisect_right(starts, value) - 1
+            result.append(country_ids[countries[i]] if i >= 0 and value <= ends[i] else None)
+
+        return result
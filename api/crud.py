@@ -1,8 +1,326 @@
-from typing import List, Optional, cast
+import csv
+import io
+import itertools
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    cast,
+)
 
 import schemas
-from models import Aircraft, AircraftImage, Airline, Realtime, Route
+from lookup_cache import TTLCache, aircraft_cache, route_cache
+from models import (
+    Aircraft,
+    AircraftImage,
+    Airline,
+    Airport,
+    Realtime,
+    Route,
+    WorkItem,
+    WorkKind,
+    WorkStatus,
+)
+from responses import SearchResult
+from search import SearchKind
+from sqlalchemy import (
+    Integer,
+    case,
+    event,
+    func,
+    inspect,
+    literal_column,
+    or_,
+    select,
+    text,
+    tuple_,
+    union,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+T = TypeVar('T')
+
+# Work items are given up on after this many attempts that did not resolve them.
+MAX_WORK_ATTEMPTS = 5
+# Failed work items are tried again when they are enqueued again after this long.
+FAILED_WORK_RETRY_AFTER = timedelta(days=1)
+
+
+def _get_cached_by_icaos(
+    db: Session, cache: TTLCache, model: Any, icaos: Iterable[str]
+) -> Dict[str, Any]:
+    """
+    Looks up rows by their icao primary key in `cache` and queries only the missing keys.
+    Keys that do not exist in the database are cached as negative entries.
+    """
+    result: Dict[str, Any] = {}
+    missing = set()
+
+    for icao in set(icaos):
+        found, row = cache.lookup(icao)
+        if not found:
+            missing.add(icao)
+        elif row is not None:
+            result[icao] = row
+
+    if not missing:
+        return result
+
+    for row in db.query(model).filter(model.icao.in_(missing)).all():
+        # Detach the row, so it stays readable after this session is closed.
+        db.expunge(row)
+        cache.put(row.icao, row)
+        result[row.icao] = row
+        missing.discard(row.icao)
+
+    for icao in missing:
+        cache.put(icao, None)
+
+    return result
+
+
+class UpsertResult(NamedTuple):
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+
+# Rows written by bulk_upsert are evicted from the cache of their model.
+_caches: Dict[Any, TTLCache] = {Aircraft: aircraft_cache, Route: route_cache}
+
+
+def _is_sqlite(db: Any) -> bool:
+    return bool(db.bind.dialect.name == 'sqlite')
+
+
+def _insert(db: Session, model: Any) -> Any:
+    """Returns an INSERT with the ON CONFLICT clauses of the database of the session."""
+    if _is_sqlite(db):
+        return sqlite.insert(model)
+
+    return postgresql.insert(model)
+
+
+def get_column_values(row: Any) -> Dict[str, Any]:
+    """Returns the columns that were set on a model instance, like Session.merge would copy."""
+    return {
+        column.key: getattr(row, column.key)
+        for column in inspect(row).mapper.column_attrs
+        if column.key in row.__dict__
+    }
+
+
+def bulk_upsert(
+    db: Session,
+    model: Any,
+    rows: Iterable[Any],
+    conflict_key: Sequence[str],
+    update_columns: Optional[Sequence[str]] = None,
+    batch_size: int = 1000,
+    preserve_existing: bool = False,
+    commit: bool = True,
+) -> UpsertResult:
+    """
+    Inserts or updates rows (dicts of column values or model instances) with one
+    INSERT ... ON CONFLICT statement per batch.
+
+    On a conflict, `update_columns` (by default all columns of the row except `conflict_key`)
+    are updated. With `preserve_existing`, only columns that are still NULL are updated, so
+    values of richer sources are kept. Rows that would not change are not written at all.
+    Pass `commit=False` to leave committing to the caller (see batch_session.BatchSession).
+    """
+    result = UpsertResult()
+
+    for batch in chunked(rows, batch_size):
+        # Postgres refuses to update the same row twice in one statement, the last row wins.
+        values: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        for row in batch:
+            row_values = row if isinstance(row, dict) else get_column_values(row)
+            values[tuple(row_values[key] for key in conflict_key)] = row_values
+
+        # A multi-row VALUES clause needs the same columns in every row.
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for row_values in values.values():
+            groups.setdefault(tuple(sorted(row_values)), []).append(row_values)
+
+        for columns, group in groups.items():
+            counts = _upsert(
+                db, model, group, columns, conflict_key, update_columns, preserve_existing
+            )
+            result = UpsertResult(*(a + b for a, b in zip(result, counts)))
+
+        _invalidate_after_commit(db, model, [key[0] for key in values])
+
+    if commit:
+        db.commit()
+
+    return result
+
+
+def _invalidate_cached_rows(session: Session, transaction: Any) -> None:
+    # Also runs for the SAVEPOINTs of BatchSession, only the outermost transaction counts.
+    if transaction.parent is not None:
+        return
+
+    for cache, keys in session.info.pop('invalidate_after_commit', []):
+        for key in keys:
+            cache.invalidate(key)
+
+
+def _invalidate_after_commit(db: Session, model: Any, keys: List[Any]) -> None:
+    """
+    Drops rows from the cache of `model` when the transaction that changed them ends.
+    Before that, a concurrent request would read the old row and cache it again.
+    """
+    cache = _caches.get(model)
+    if cache is None or not keys:
+        return
+
+    if not event.contains(db, 'after_transaction_end', _invalidate_cached_rows):
+        event.listen(db, 'after_transaction_end', _invalidate_cached_rows)
+
+    db.info.setdefault('invalidate_after_commit', []).append((cache, keys))
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def _upsert(
+    db: Session,
+    model: Any,
+    rows: List[Dict[str, Any]],
+    columns: Sequence[str],
+    conflict_key: Sequence[str],
+    update_columns: Optional[Sequence[str]],
+    preserve_existing: bool,
+) -> UpsertResult:
+    table = model.__table__
+    statement = _insert(db, model)
+
+    if update_columns is None:
+        update_columns = [column for column in columns if column not in conflict_key]
+
+    updates = {
+        column: (
+            func.coalesce(table.c[column], statement.excluded[column])
+            if preserve_existing
+            else statement.excluded[column]
+        )
+        for column in update_columns
+        if column in columns
+    }
+    if updates:
+        statement = statement.on_conflict_do_update(
+            index_elements=conflict_key,
+            set_=updates,
+            where=or_(
+                *(table.c[column].is_distinct_from(value) for column, value in updates.items())
+            ),
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=conflict_key)
+
+    # Scalar column defaults (e.g. favorite=False) only apply to new rows. SQLAlchemy fills
+    # them in when it executes a statement, which is bypassed below.
+    defaults = {
+        column.key: column.default.arg
+        for column in table.columns
+        if column.key not in columns and column.default is not None and column.default.is_scalar
+    }
+    rows = [{**defaults, **row} for row in rows]
+    columns = [*columns, *defaults]
+
+    if _is_sqlite(db):
+        return _upsert_sqlite(db, table, statement, rows, conflict_key)
+
+    # xmax is only 0 for rows that were inserted, rows that did not change are not returned.
+    statement = statement.returning(literal_column('xmax = 0'))
+    compiled = statement.compile(dialect=db.get_bind().dialect, column_keys=list(columns))
+
+    # Only imported here, so SQLite deployments do not need psycopg2.
+    from psycopg2.extras import execute_values
+
+    # SQLAlchemy cannot return rows of an executemany with ON CONFLICT, so let psycopg2 send
+    # the rows as one multi-row VALUES statement instead. The INSERT renders its columns in
+    # table order, with a pyformat parameter named after each column.
+    template = '({})'.format(
+        ', '.join(f'%({column.key})s' for column in table.columns if column.key in columns)
+    )
+    sql = compiled.string
+    if template not in sql:
+        raise ValueError(f'Unexpected VALUES clause in {sql}')
+
+    cursor = db.connection().connection.cursor()
+    returned = execute_values(
+        cursor,
+        sql.replace(template, '%s', 1),
+        [compiled.construct_params(row) for row in rows],
+        template=template,
+        page_size=len(rows),
+        fetch=True,
+    )
+    inserted = sum(1 for (x,) in returned if x)
+    return UpsertResult(inserted, len(returned) - inserted, len(rows) - len(returned))
+
+
+def _upsert_sqlite(
+    db: Session,
+    table: Any,
+    statement: Any,
+    rows: List[Dict[str, Any]],
+    conflict_key: Sequence[str],
+) -> UpsertResult:
+    # SQLite has no xmax to tell inserts from updates, so count the existing keys up front.
+    # Upserts that did not change a row are not counted as changes by SQLite.
+    key = tuple_(*(table.c[column] for column in conflict_key))
+    existing = db.scalar(
+        select(func.count())
+        .select_from(table)
+        .where(key.in_([tuple(row[column] for column in conflict_key) for row in rows]))
+    )
+    changed = db.execute(statement, rows).rowcount
+    inserted = len(rows) - existing
+    return UpsertResult(inserted, changed - inserted, len(rows) - changed)
+
+
+def _paginate(statement: Select, key: Any, skip: int, limit: int, after: Optional[str]) -> Select:
+    if after is not None:
+        statement = statement.where(key > after)
+
+    return statement.order_by(key).offset(skip).limit(limit)
+
+
+def iterate_table(db: Session, model: Any, batch_size: int = 1000) -> Iterator[Any]:
+    """Yields all rows of a table in batches, with keyset pagination on the primary key."""
+    key = inspect(model).primary_key[0]
+    after = None
+
+    while True:
+        rows = db.execute(_paginate(select(model), key, 0, batch_size, after)).scalars().all()
+        yield from rows
+
+        if len(rows) < batch_size:
+            return
+
+        after = getattr(rows[-1], key.key)
 
 
 # Aircraft
@@ -10,29 +328,87 @@ def get_aircraft(db: Session, icao: str) -> Optional[Aircraft]:
     return cast(Optional[Aircraft], db.query(Aircraft).filter(Aircraft.icao == icao).first())
 
 
-def get_aircraft_paginated(db: Session, skip: int = 0, limit: int = 100) -> List[Aircraft]:
-    return cast(List[Aircraft], db.query(Aircraft).offset(skip).limit(limit).all())
+def get_aircraft_cached(db: Session, icao: str) -> Optional[Aircraft]:
+    return cast(Optional[Aircraft], get_aircraft_by_icaos(db, [icao]).get(icao))
+
+
+def get_aircraft_by_icaos(db: Session, icaos: Iterable[str]) -> Dict[str, Aircraft]:
+    return _get_cached_by_icaos(db, aircraft_cache, Aircraft, icaos)
+
+
+def _select_aircraft_page(
+    skip: int,
+    limit: int,
+    after: Optional[str],
+    airline: Optional[str],
+    country: Optional[str],
+    aircrafttype: Optional[str],
+    category: Optional[str],
+) -> Select:
+    statement = select(Aircraft)
+
+    if airline is not None:
+        statement = statement.where(Aircraft.airline_iata == airline)
+    if country is not None:
+        statement = statement.where(Aircraft.country == country)
+    if aircrafttype is not None:
+        statement = statement.where(Aircraft.aircrafttype == aircrafttype)
+    if category is not None:
+        statement = statement.where(Aircraft.category == category)
+
+    return _paginate(statement, Aircraft.icao, skip, limit, after)
+
+
+def get_aircraft_paginated(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[str] = None,
+    airline: Optional[str] = None,
+    country: Optional[str] = None,
+    aircrafttype: Optional[str] = None,
+    category: Optional[str] = None,
+) -> List[Aircraft]:
+    """
+    Returns a page of aircraft ordered by icao. Pass the icao of the last aircraft of a page as
+    `after` to get the next one, which stays fast on deep pages unlike `skip`.
+    """
+    statement = _select_aircraft_page(skip, limit, after, airline, country, aircrafttype, category)
+    return cast(List[Aircraft], db.execute(statement).scalars().all())
 
 
 def create_aircraft(db: Session, db_aircraft: Aircraft) -> Aircraft:
     db.add(db_aircraft)
     db.commit()
+    aircraft_cache.invalidate(db_aircraft.icao)
     db.refresh(db_aircraft)
     return cast(Aircraft, db_aircraft)
 
 
-def update_aircraft(db: Session, db_aircraft: Aircraft) -> bool:
-    if get_aircraft(db, db_aircraft.icao) is None:
-        create_aircraft(db, db_aircraft)
-        return True
+def get_registrations_count(db: Session) -> int:
+    return int(db.query(Aircraft).count())
+
 
-    db.merge(db_aircraft)
-    db.commit()
-    return False
+_select_estimated_count = text(
+    'SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)'
+)
 
 
-def get_registrations_count(db: Session) -> int:
-    return int(db.query(Aircraft).count())
+def get_estimated_count(db: Session, model: Any) -> int:
+    """
+    Returns the row count of a table as estimated by Postgres, which is maintained by
+    (auto)vacuum and analyze, instead of scanning the whole table with count(*).
+    SQLite keeps no estimates, so there, and for Postgres tables that have never been
+    analyzed, the rows are counted.
+    """
+    estimate = None
+    if not _is_sqlite(db):
+        estimate = db.execute(_select_estimated_count, {'table': model.__tablename__}).scalar()
+
+    if estimate is None or estimate < 0:
+        return int(db.query(model).count())
+
+    return int(estimate)
 
 
 # AircraftImage
@@ -53,6 +429,24 @@ def get_images(db: Session, icao: str, skip: int = 0, limit: int = 100) -> List[
     )
 
 
+def get_images_by_icaos(db: Session, icaos: Iterable[str]) -> Dict[str, List[AircraftImage]]:
+    icao_set = set(icaos)
+    if not icao_set:
+        return {}
+
+    result: Dict[str, List[AircraftImage]] = {}
+    images = (
+        db.query(AircraftImage)
+        .filter(AircraftImage.icao.in_(icao_set))
+        .order_by(AircraftImage.icao, AircraftImage.number)
+        .all()
+    )
+    for image in images:
+        result.setdefault(image.icao, []).append(image)
+
+    return result
+
+
 def create_aircraft_image(db: Session, db_image: AircraftImage) -> AircraftImage:
     db.add(db_image)
     db.commit()
@@ -61,7 +455,12 @@ def create_aircraft_image(db: Session, db_image: AircraftImage) -> AircraftImage
 
 
 def set_aircraft_has_no_images(db: Session, aircraft: Aircraft) -> None:
-    aircraft.has_no_images = True
+    # The aircraft might be a cached row, which is shared by all threads and must not be
+    # changed. It is dropped from the cache instead, once the update is committed.
+    db.query(Aircraft).filter(Aircraft.icao == aircraft.icao).update(
+        {'has_no_images': True}, synchronize_session=False
+    )
+    _invalidate_after_commit(db, Aircraft, [aircraft.icao])
     db.commit()
 
 
@@ -70,45 +469,76 @@ def get_route(db: Session, icao: str) -> Optional[Route]:
     return cast(Optional[Route], db.query(Route).filter(Route.icao == icao).first())
 
 
-def get_route_by_dep_iata(db: Session, dep_iata: str) -> Optional[Route]:
-    return cast(
-        Optional[Route],
-        db.query(Route)
-        .filter(Route.dep_iata == dep_iata)
-        .filter(Route.dep_icao.isnot(None))
-        .first(),
-    )
-
-
-def get_route_by_arr_iata(db: Session, arr_iata: str) -> Optional[Route]:
-    return cast(
-        Optional[Route],
-        db.query(Route)
-        .filter(Route.arr_iata == arr_iata)
-        .filter(Route.arr_icao.isnot(None))
-        .first(),
-    )
-
-
-def get_routes_paginated(db: Session, skip: int = 0, limit: int = 100) -> List[Route]:
-    return cast(List[Route], db.query(Route).offset(skip).limit(limit).all())
+def get_route_cached(db: Session, icao: str) -> Optional[Route]:
+    return cast(Optional[Route], get_routes_by_icaos(db, [icao]).get(icao))
+
+
+def get_routes_by_icaos(db: Session, icaos: Iterable[str]) -> Dict[str, Route]:
+    return _get_cached_by_icaos(db, route_cache, Route, icaos)
+
+
+def _select_routes_page(
+    skip: int,
+    limit: int,
+    after: Optional[str],
+    airline: Optional[str],
+    airport: Optional[str],
+) -> Select:
+    filters = []
+
+    if airline is not None:
+        column = Route.airline_iata if len(airline) == 2 else Route.airline_icao
+        filters.append(column == airline)
+    if airport is not None:
+        if len(airport) == 3:
+            columns = (Route.dep_iata, Route.arr_iata)
+        else:
+            columns = (Route.dep_icao, Route.arr_icao)
+
+        # `dep = x OR arr = x` can at best combine both indexes in a bitmap and sort the
+        # result. Instead, each side reads the first `skip + limit` matching icaos from its
+        # (column, icao) index in order, and only the union of those is sorted.
+        pages = [
+            _paginate(
+                select(Route.icao).where(*filters, column == airport),
+                Route.icao,
+                0,
+                skip + limit,
+                after,
+            ).subquery()
+            for column in columns
+        ]
+        icaos = union(*(select(page.c.icao) for page in pages))
+        filters = [Route.icao.in_(icaos.scalar_subquery())]
+
+    return _paginate(select(Route).where(*filters), Route.icao, skip, limit, after)
+
+
+def get_routes_paginated(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[str] = None,
+    airline: Optional[str] = None,
+    airport: Optional[str] = None,
+) -> List[Route]:
+    """
+    Returns a page of routes ordered by icao, see get_aircraft_paginated.
+    `airline` is an ICAO (KLM) or IATA (KL) code, `airport` an ICAO (EHAM) or IATA (AMS) code of
+    the departure or arrival airport.
+    """
+    statement = _select_routes_page(skip, limit, after, airline, airport)
+    return cast(List[Route], db.execute(statement).scalars().all())
 
 
 def create_route(db: Session, db_route: Route) -> Route:
     db.add(db_route)
     db.commit()
+    route_cache.invalidate(db_route.icao)
     db.refresh(db_route)
     return cast(Route, db_route)
 
 
-def update_route(db: Session, db_route: Route) -> None:
-    if get_route(db, db_route.icao) is None:
-        create_airline(db, db_route)
-
-    db.merge(db_route)
-    db.commit()
-
-
 def get_route_count(db: Session) -> int:
     return int(db.query(Route).count())
 
@@ -125,40 +555,357 @@ def create_airline(db: Session, db_airline: Airline) -> Airline:
     return cast(Airline, db_airline)
 
 
-def update_airline(db: Session, db_airline: Airline) -> None:
-    if get_airline(db, db_airline.iata_code) is None:
-        create_airline(db, db_airline)
+# Airport
+def get_airports(db: Session) -> List[Airport]:
+    airports = cast(List[Airport], db.query(Airport).all())
+
+    # Detach the airports, so they can be kept in memory after this session is closed.
+    for airport in airports:
+        db.expunge(airport)
+
+    return airports
+
+
+def backfill_airports_from_routes(db: Session) -> UpsertResult:
+    """
+    Fills the airportdata table from the airports of the routes, for databases of versions
+    that stored airports only as part of routesdata.
+    """
+    # Airport columns by the route column they are read from, e.g. dep_airport for name.
+    names = {
+        'icao': 'icao',
+        'iata': 'iata',
+        'name': 'airport',
+        'location': 'loc',
+        'country': 'country',
+        'country_id': 'country_id',
+        'lat': 'lat',
+        'lon': 'lon',
+        'alt': 'alt',
+    }
+    airports: Dict[str, Dict[str, Any]] = {}
+
+    for prefix in ('dep', 'arr'):
+        columns = [getattr(Route, f'{prefix}_{name}') for name in names.values()]
+        statement = select(*columns).where(columns[0].isnot(None)).distinct()
+
+        for row in db.execute(statement):
+            airports.setdefault(row[0], dict(zip(names, row)))
+
+    return bulk_upsert(db, Airport, airports.values(), ['icao'], preserve_existing=True)
+
+
+# Search
+def get_search_keys(
+    db: Session,
+) -> Tuple[List[str], List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """Returns the callsigns, (icao, registration) of aircraft and (iata, name) of airlines."""
+    routes = [icao for (icao,) in db.query(Route.icao)]
+    aircraft = [(icao, reg) for icao, reg in db.query(Aircraft.icao, Aircraft.registration)]
+    airlines = [(iata, name) for iata, name in db.query(Airline.iata_code, Airline.airline_name)]
+    return routes, aircraft, airlines
+
+
+def _select_by_prefix(prefix: str, limit: int) -> Tuple[Select, Select, Select]:
+    routes = (
+        select(Route.icao)
+        .where(Route.icao.startswith(prefix, autoescape=True))
+        .order_by(Route.icao)
+        .limit(limit)
+    )
+    aircraft = (
+        select(Aircraft.icao, Aircraft.registration)
+        .where(
+            or_(
+                Aircraft.icao.startswith(prefix, autoescape=True),
+                Aircraft.registration.startswith(prefix, autoescape=True),
+            )
+        )
+        .order_by(Aircraft.icao)
+        .limit(limit)
+    )
+    airlines = (
+        select(Airline.iata_code, Airline.airline_name)
+        .where(func.upper(Airline.airline_name).startswith(prefix, autoescape=True))
+        .order_by(Airline.airline_name)
+        .limit(limit)
+    )
+    return routes, aircraft, airlines
+
 
-    db.merge(db_airline)
+# Realtime
+def create_realtime_entry(db: Session, db_realtime: Realtime) -> Realtime:
+    db.add(db_realtime)
     db.commit()
+    db.refresh(db_realtime)
+    return cast(Airline, db_realtime)
 
 
-def update_route_airport_data(db: Session, db_route: Route) -> None:
-    dep_airport: Route = get_route_by_dep_iata(db, db_route.dep_iata)
-    arr_airport: Route = get_route_by_arr_iata(db, db_route.arr_iata)
+# Work queue
+def enqueue_work_items(
+    db: Session, kind: WorkKind, items: Sequence[Tuple[str, Optional[str]]]
+) -> None:
+    """
+    Enqueues (key, registration) pairs. Keys that are already queued are left untouched, except
+    for filling in a registration that was not known yet, and for failed items of which the
+    last attempt is more than FAILED_WORK_RETRY_AFTER ago, which are pending again.
+    """
+    if not items:
+        return
+
+    now = datetime.utcnow()
+    rows = {
+        key: {
+            'kind': kind.value,
+            'key': key,
+            'registration': registration,
+            'status': WorkStatus.pending.value,
+            'attempts': 0,
+            'enqueued_at': now,
+        }
+        for key, registration in items
+    }
+    statement = _insert(db, WorkItem).values(list(rows.values()))
+    retry = (WorkItem.status == WorkStatus.failed.value) & (
+        WorkItem.attempted_at < now - FAILED_WORK_RETRY_AFTER
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=['kind', 'key'],
+        set_={
+            'registration': func.coalesce(WorkItem.registration, statement.excluded.registration),
+            'status': case((retry, WorkStatus.pending.value), else_=WorkItem.status),
+            'attempts': case((retry, 0), else_=WorkItem.attempts),
+        },
+        where=(WorkItem.registration.is_(None) & statement.excluded.registration.isnot(None))
+        | retry,
+    )
+    db.execute(statement)
+    db.commit()
 
-    db_route.dep_airport = dep_airport.dep_airport
-    db_route.dep_icao = dep_airport.dep_icao
-    db_route.dep_country = dep_airport.dep_country
-    db_route.dep_country_id = dep_airport.dep_country_id
-    db_route.dep_lat = dep_airport.dep_lat
-    db_route.dep_lon = dep_airport.dep_lon
-    db_route.dep_alt = dep_airport.dep_alt
 
-    db_route.arr_airport = arr_airport.arr_airport
-    db_route.arr_icao = arr_airport.arr_icao
-    db_route.arr_country = arr_airport.arr_country
-    db_route.arr_country_id = arr_airport.arr_country_id
-    db_route.arr_lat = arr_airport.arr_lat
-    db_route.arr_lon = arr_airport.arr_lon
-    db_route.arr_alt = arr_airport.arr_alt
+def get_pending_work_items(
+    db: Session, kind: WorkKind, limit: Optional[int] = None, with_registration: bool = False
+) -> List[WorkItem]:
+    query = db.query(WorkItem).filter(WorkItem.kind == kind.value)
+    query = query.filter(WorkItem.status == WorkStatus.pending.value)
 
-    update_route(db, db_route)
+    if with_registration:
+        query = query.filter(WorkItem.registration.isnot(None))
 
+    query = query.order_by(WorkItem.attempts, WorkItem.enqueued_at)
+    return cast(List[WorkItem], query.limit(limit).all())
 
-# Realtime
-def create_realtime_entry(db: Session, db_realtime: Realtime) -> Realtime:
-    db.add(db_realtime)
+
+def _select_pending_work_count(kind: WorkKind) -> Select:
+    return (
+        select(func.count())
+        .select_from(WorkItem)
+        .where(WorkItem.kind == kind.value)
+        .where(WorkItem.status == WorkStatus.pending.value)
+    )
+
+
+def get_pending_work_count(db: Session, kind: WorkKind) -> int:
+    return int(db.scalar(_select_pending_work_count(kind)))
+
+
+def record_work_attempts(db: Session, kind: WorkKind, keys: Iterable[str], source: str) -> None:
+    """
+    Counts an attempt for the keys that are still pending. Call resolve_work_items first, so
+    an item that was resolved by this attempt is not counted, or marked failed.
+    """
+    db.query(WorkItem).filter(WorkItem.kind == kind.value).filter(
+        WorkItem.status == WorkStatus.pending.value
+    ).filter(WorkItem.key.in_(set(keys))).update(
+        {
+            WorkItem.attempts: WorkItem.attempts + 1,
+            WorkItem.source: source,
+            WorkItem.attempted_at: datetime.utcnow(),
+            WorkItem.status: case(
+                (WorkItem.attempts + 1 >= MAX_WORK_ATTEMPTS, WorkStatus.failed.value),
+                else_=WorkItem.status,
+            ),
+        },
+        synchronize_session=False,
+    )
     db.commit()
-    db.refresh(db_realtime)
-    return cast(Airline, db_realtime)
+
+
+def resolve_work_items(db: Session) -> None:
+    """Marks the work items of which the route or aircraft details are stored by now as done."""
+    db.query(WorkItem).filter(WorkItem.kind == WorkKind.route.value).filter(
+        WorkItem.status == WorkStatus.pending.value
+    ).filter(WorkItem.key.in_(db.query(Route.icao))).update(
+        {WorkItem.status: WorkStatus.done.value}, synchronize_session=False
+    )
+
+    complete_aircraft = (
+        db.query(Aircraft.icao)
+        .filter(Aircraft.registration.isnot(None))
+        .filter(Aircraft.aircrafttype.isnot(None))
+    )
+    db.query(WorkItem).filter(WorkItem.kind == WorkKind.aircraft.value).filter(
+        WorkItem.status == WorkStatus.pending.value
+    ).filter(WorkItem.key.in_(complete_aircraft)).update(
+        {WorkItem.status: WorkStatus.done.value}, synchronize_session=False
+    )
+    db.commit()
+
+
+# Bulk loading
+def supports_copy(db: Session) -> bool:
+    """Staging tables and COPY are only available on Postgres, use bulk_upsert otherwise."""
+    return not _is_sqlite(db)
+
+
+def create_staging_table(db: Session, model: Any) -> str:
+    """
+    Creates a temporary copy of the table of `model` that is dropped on commit.
+    Its staging_id column keeps track of the order in which rows were loaded.
+    """
+    table = model.__tablename__
+    staging_table = f'{table}_staging'
+    db.execute(
+        text(f'CREATE TEMP TABLE {staging_table} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP')
+    )
+    db.execute(text(f'ALTER TABLE {staging_table} ADD COLUMN staging_id bigserial'))
+    return staging_table
+
+
+def copy_into_table(
+    db: Session, table: str, columns: List[str], rows: Iterable[Sequence[Any]]
+) -> None:
+    """Loads rows with COPY, which is much faster than INSERT. None values are loaded as NULL."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    cursor = db.connection().connection.cursor()
+    cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def merge_staging_table(
+    db: Session,
+    model: Any,
+    staging_table: str,
+    columns: List[str],
+    update_columns: List[str],
+    index_elements: List[str],
+) -> int:
+    """
+    Inserts or updates the rows of a staging table into the table of `model` with a single
+    statement. When a key was loaded more than once, the row that was loaded last wins.
+    """
+    keys = ', '.join(index_elements)
+    column_list = ', '.join(columns)
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in update_columns)
+
+    result = db.execute(
+        text(
+            f'INSERT INTO {model.__tablename__} ({column_list}) '
+            f'SELECT DISTINCT ON ({keys}) {column_list} FROM {staging_table} '
+            f'ORDER BY {keys}, staging_id DESC '
+            f'ON CONFLICT ({keys}) DO UPDATE SET {updates}'
+        )
+    )
+    return int(result.rowcount)
+
+
+def copy_table(source: Session, target: Session, model: Any, batch_size: int = 5000) -> int:
+    """
+    Copies the rows of a table to another database, e.g. from Postgres to SQLite.
+    Rows of which the primary key already exists in the target are skipped, so an interrupted
+    copy can be started again.
+    """
+    statement = _insert(target, model).on_conflict_do_nothing()
+    copied = 0
+
+    for rows in chunked(iterate_table(source, model, batch_size), batch_size):
+        target.execute(statement, [get_column_values(row) for row in rows])
+        target.commit()
+        source.expunge_all()
+        copied += len(rows)
+
+    # Serial ids were copied as they are, so move their sequence past them.
+    key = inspect(model).primary_key[0]
+    if not _is_sqlite(target) and isinstance(key.type, Integer):
+        table = model.__tablename__
+        target.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', '{key.name}'), "
+                f'(SELECT coalesce(max({key.name}), 0) + 1 FROM {table}), false)'
+            )
+        )
+        target.commit()
+
+    return copied
+
+
+# Async reads for the web endpoints
+async def get_aircraft_paginated_async(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[str] = None,
+    airline: Optional[str] = None,
+    country: Optional[str] = None,
+    aircrafttype: Optional[str] = None,
+    category: Optional[str] = None,
+) -> List[Aircraft]:
+    statement = _select_aircraft_page(skip, limit, after, airline, country, aircrafttype, category)
+    result = await db.execute(statement)
+    return cast(List[Aircraft], result.scalars().all())
+
+
+async def get_routes_paginated_async(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[str] = None,
+    airline: Optional[str] = None,
+    airport: Optional[str] = None,
+) -> List[Route]:
+    result = await db.execute(_select_routes_page(skip, limit, after, airline, airport))
+    return cast(List[Route], result.scalars().all())
+
+
+async def get_estimated_count_async(db: AsyncSession, model: Any) -> int:
+    estimate = None
+    if not _is_sqlite(db):
+        estimate = await db.scalar(_select_estimated_count, {'table': model.__tablename__})
+
+    if estimate is None or estimate < 0:
+        estimate = await db.scalar(select(func.count()).select_from(model))
+
+    return int(estimate)
+
+
+async def get_pending_work_count_async(db: AsyncSession, kind: WorkKind) -> int:
+    return int(await db.scalar(_select_pending_work_count(kind)))
+
+
+async def search_by_prefix_async(
+    db: AsyncSession, prefix: str, limit: int = 10
+) -> List[SearchResult]:
+    """Searches the tables like SearchIndex.search does, for when the index is not built yet."""
+    prefix = prefix.strip().upper()
+    if not prefix:
+        return []
+
+    routes, aircraft, airlines = _select_by_prefix(prefix, limit)
+    return (
+        [
+            SearchResult(kind=SearchKind.route, id=icao, text=icao)
+            for (icao,) in await db.execute(routes)
+        ]
+        + [
+            SearchResult(
+                kind=SearchKind.aircraft, id=icao, text=icao if icao.startswith(prefix) else reg
+            )
+            for icao, reg in await db.execute(aircraft)
+        ]
+        + [
+            SearchResult(kind=SearchKind.airline, id=iata, text=name)
+            for iata, name in await db.execute(airlines)
+        ]
+    )
@@ -1,15 +1,20 @@
 import os
+import time
 from datetime import datetime
-from typing import Any, Dict, Iterator, Optional
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import crud
-import pycountry
-import requests
+from airports import AirportIndex
 from collector import Collector
 from config import Config
+from countries import CountryIndex
+from database import SessionLocal
+from http_client import http_client
 from logger import get_logger
-from models import Realtime
-from responses import AircraftImagePayload, DUMP1090Response
+from models import Aircraft, Realtime, Route, WorkKind
+from responses import AircraftImagePayload, DUMP1090Response, RoutePayload, SearchResult
+from search import SearchIndex
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session
 
 
@@ -20,61 +25,104 @@ class ADSBData:
         self.collector = Collector(self)
         self.logger = get_logger('ADS-B Data')
 
+    @classmethod
+    def without_db(cls, config: Config) -> 'ADSBData':
+        """For the async endpoints, which pass their AsyncSession to the *_async methods."""
+        return cls(None, config)
+
     def get_db(self) -> Session:
+        if self.db is None:
+            raise RuntimeError('ADSBData was created without a database session')
+
         return self.db
 
-    def get_statistics(self) -> Dict[str, Any]:
-        live_flights = self.get_live_flights()
-        routes = crud.get_route_count(self.get_db())
-        registrations = crud.get_registrations_count(self.get_db())
+    def get_statistics(self, live_flight_count: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Returns counters that are cheap to compute. Pass `live_flight_count` when a live snapshot
+        is available, otherwise the aircraft of dump1090 are counted without enriching them.
+        """
+        if live_flight_count is None:
+            live_flight_count = len(self.config.dump1090.get_live_flights_sync().aircraft)
 
         return {
-            'live_flight_count': len(list(live_flights)),
-            'routes_count': routes,
-            'registrations_count': registrations,
+            'live_flight_count': live_flight_count,
+            'routes_count': crud.get_estimated_count(self.get_db(), Route),
+            'registrations_count': crud.get_estimated_count(self.get_db(), Aircraft),
             'missing_routes': self.get_missing_routes(),
             'missing_aircraft': self.get_missing_aircraft(),
             'airline_logos': self.get_airline_logos(),
         }
 
+    async def get_statistics_async(
+        self, db: AsyncSession, live_flight_count: int
+    ) -> Dict[str, Any]:
+        """get_statistics for the web endpoints, which does not block the event loop."""
+        return {
+            'live_flight_count': live_flight_count,
+            'routes_count': await crud.get_estimated_count_async(db, Route),
+            'registrations_count': await crud.get_estimated_count_async(db, Aircraft),
+            'missing_routes': await crud.get_pending_work_count_async(db, WorkKind.route),
+            'missing_aircraft': await crud.get_pending_work_count_async(db, WorkKind.aircraft),
+            'airline_logos': self.get_airline_logos(),
+        }
+
+    def get_cache_statistics(self) -> Dict[str, Dict[str, int]]:
+        return {
+            'aircraft': self.config.cached_aircraft.get_statistics(),
+            'routes': self.config.cached_routes.get_statistics(),
+        }
+
     def get_missing_routes(self) -> int:
-        with open(self.config.routes_to_update_path, 'r') as f:
-            return len(f.readlines())
+        return int(crud.get_pending_work_count(self.get_db(), WorkKind.route))
 
     def get_missing_aircraft(self) -> int:
-        with open(self.config.aircraft_to_update_path, 'r') as f:
-            return len(f.readlines())
+        return int(crud.get_pending_work_count(self.get_db(), WorkKind.aircraft))
 
     def get_airline_logos(self) -> int:
-        return len(os.listdir(self.config.ac_logos_path))
+        found, count = self.config.airline_logo_count.lookup('count')
 
-    def get_live_flights(self) -> DUMP1090Response:
-        response = requests.get('http://localhost:8080/data/aircraft.json')
-        if not response.ok:
-            raise ConnectionError('Could not connect to dump1090')
+        if not found or count is None:
+            count = len(os.listdir(self.config.ac_logos_path))
+            self.config.airline_logo_count.put('count', count)
+
+        return int(count)
 
-        response_json: DUMP1090Response = DUMP1090Response.parse_obj(response.json())
+    def get_live_flights(self) -> DUMP1090Response:
+        return self.enrich_live_flights(self.config.dump1090.get_live_flights_sync())
 
+    def enrich_live_flights(self, response_json: DUMP1090Response) -> DUMP1090Response:
         for ac in response_json:
             ac.hex = ac.hex.upper().strip()
+            if ac.flight:
+                ac.flight = ac.flight.strip()
+
+        # Fetch everything up front, so the number of queries does not grow with the traffic.
+        db = self.get_db()
+        aircraft = crud.get_aircraft_by_icaos(db, [ac.hex for ac in response_json])
+        routes = crud.get_routes_by_icaos(db, [ac.flight for ac in response_json if ac.flight])
+        images_per_aircraft = crud.get_images_by_icaos(db, aircraft.keys())
+        missing_routes: List[Tuple[str, Optional[str]]] = []
+        missing_aircraft: List[Tuple[str, Optional[str]]] = []
+
+        for ac in response_json:
             icao = ac.hex
-            ac_type = crud.get_aircraft(self.get_db(), icao)
+            ac_type = aircraft.get(icao)
 
             if ac.flight:
-                ac.flight = ac.flight.strip()
-                route = crud.get_route(self.get_db(), ac.flight)
-                ac.route = route
+                route = routes.get(ac.flight)
+                ac.route = RoutePayload.from_orm(route) if route is not None else None
 
                 if route is not None:
                     iata = route.airline_iata
 
-                    if iata and self.get_airline_icon(iata) is not None:
+                    if iata and self.get_airline_icon(iata, fetch=False) is not None:
                         ac.airline_icon = f"airline_icon.svg?iata={iata}"
                 elif (
                     ac_type is None
-                    or ac.flight.strip() != ac_type.registration.replace('-', '').strip()
+                    or not ac_type.registration
+                    or ac.flight != ac_type.registration.replace('-', '').strip()
                 ):
-                    self.get_route_details(ac.flight)
+                    missing_routes.append((ac.flight, None))
 
             if ac_type is not None:
                 ac.registration = ac_type.registration
@@ -82,7 +130,13 @@ class ADSBData:
                 ac.icon_category = ac_type.category
                 ac.country = ac_type.country
 
-                images = self.collector.get_aircraft_image_data(ac_type, icao)
+                # Never wait on airport-data.com here, new images show up in a later snapshot.
+                images = images_per_aircraft.get(icao, [])
+                if not images and not ac_type.has_no_images:
+                    self.config.background_jobs.submit(
+                        f'images:{icao}', self.fetch_aircraft_images, icao
+                    )
+
                 ac.images = []
 
                 for i, _ in enumerate(images):
@@ -95,29 +149,29 @@ class ADSBData:
                         )
                     )
             if not ac_type or not ac_type.registration or not ac_type.aircrafttype:
-                self.get_aircraft_details(
-                    icao, ac_type.registration if ac_type is not None else None
-                )
+                missing_aircraft.append((icao, ac_type.registration if ac_type else None))
 
+        self.enqueue_work_items(WorkKind.route, missing_routes)
+        self.enqueue_work_items(WorkKind.aircraft, missing_aircraft)
         return response_json
 
-    def get_route_details(self, flight: str) -> None:
-        with open(self.config.routes_to_update_path, 'r') as f:
-            text = f.read()
-
-        if not flight in text:
-            self.logger.debug(f'get_route_details {flight}')
-            with open(self.config.routes_to_update_path, 'a') as f:
-                f.write(flight + '\n')
-
-    def get_aircraft_details(self, icao: str, registration: Optional[str]) -> None:
-        with open(self.config.aircraft_to_update_path, 'r') as f:
-            text = f.read()
-
-        if not icao in text:
-            self.logger.debug(f'get_aircraft_details {icao}')
-            with open(self.config.aircraft_to_update_path, 'a') as f:
-                f.write(icao + (' ' + registration if registration is not None else '') + '\n')
+    def enqueue_work_items(self, kind: WorkKind, items: List[Tuple[str, Optional[str]]]) -> None:
+        """Enqueues routes or aircraft to collect, skipping the ones this process already queued."""
+        enqueued = self.config.enqueued_work_items
+        new_items = [
+            (key, registration)
+            for key, registration in items
+            if not enqueued.lookup(f'{kind.value}:{key}:{registration}')[0]
+        ]
+        if not new_items:
+            return
+
+        self.logger.debug(
+            f'Enqueueing {kind.value} work items: {", ".join(key for key, _ in new_items)}'
+        )
+        crud.enqueue_work_items(self.get_db(), kind, new_items)
+        for key, registration in new_items:
+            enqueued.put(f'{kind.value}:{key}:{registration}', True)
 
     def get_ac_icon(
         self,
@@ -146,7 +200,18 @@ class ADSBData:
         )
         return icon
 
-    def get_airline_icon(self, iata: str) -> Optional[str]:
+    def fetch_aircraft_images(self, icao: str) -> None:
+        # Runs in a background job, so it cannot share the session of the request.
+        with SessionLocal() as db:
+            aircraft = crud.get_aircraft(db, icao)
+            if aircraft is not None:
+                ADSBData(db, self.config).collector.get_aircraft_image_data(aircraft, icao)
+
+    def get_airline_icon(self, iata: str, fetch: bool = True) -> Optional[str]:
+        """
+        Returns the path of the cached logo of an airline.
+        If it is not cached and `fetch` is False, the logo is downloaded in a background job.
+        """
         iata = iata.upper()
 
         if len(iata) != 2:
@@ -167,7 +232,11 @@ class ADSBData:
             return None
 
         if not os.path.exists(cache_path):
-            response = requests.get(
+            if not fetch:
+                self.config.background_jobs.submit(f'logo:{iata}', self.get_airline_icon, iata)
+                return None
+
+            response = http_client.get(
                 f'https://images.kiwi.com/airlines/{size}/{iata}.png', stream=True
             )
 
@@ -180,6 +249,8 @@ class ADSBData:
                 with open(cache_path_404, 'wb') as f:
                     f.write(response.content)
 
+            self.config.airline_logo_count.invalidate('count')
+
         return cache_path
 
     def get_aircraft_image_cache_path(self, icao: str, i: int, as_thumbnail: bool = False) -> str:
@@ -216,7 +287,7 @@ class ADSBData:
     ) -> Iterator[bytes]:
         cache_path = self.get_aircraft_image_cache_path(icao, i, as_thumbnail)
         images = crud.get_images(self.get_db(), icao)
-        aircraft = crud.get_aircraft(self.get_db(), icao)
+        aircraft = crud.get_aircraft_cached(self.get_db(), icao)
 
         if len(images) < 1 and aircraft is not None:
             images = self.collector.get_aircraft_image_data(aircraft, icao)
@@ -226,7 +297,7 @@ class ADSBData:
 
         image = images[i]
         image_property = image.thumbnail_url if as_thumbnail else image.image_url
-        response = requests.get(image_property, stream=True)
+        response = http_client.get(image_property, stream=True)
 
         if response.ok:
             try:
@@ -261,29 +332,14 @@ class ADSBData:
         return str(self.config.ac_families[ac_type_icao])
 
     def get_country_id(self, name: str) -> Optional[str]:
-        if name in self.config.country_aliases.keys():
-            name = self.config.country_aliases[name]
-
-        # Retrieve from cache.
-        if name in self.config.country_ids:
-            return str(self.config.country_ids[name])
+        country_id: Optional[str] = self.config.country_resolver.resolve(name)
+        return country_id
 
-        country = pycountry.countries.get(name=name)
+    def get_country_index(self) -> CountryIndex:
+        if self.config.country_index is None:
+            self.config.country_index = CountryIndex(self.config.ac_countries, self.get_country_id)
 
-        if country is None:
-            country = pycountry.countries.get(official_name=name)
-        if country is None:
-            try:
-                country = pycountry.countries.search_fuzzy(name)[0]
-            except LookupError:
-                pass
-
-        if country is None:
-            self.logger.error(f'Error: Could not resolve country "{name}"')
-            return None
-
-        self.config.country_ids[name] = str(country.alpha_2)
-        return str(country.alpha_2)
+        return self.config.country_index
 
     def get_country(self, ac_icao: str) -> Optional[str]:
         try:
@@ -292,12 +348,85 @@ class ADSBData:
             self.logger.error(f'"{ac_icao}" is not a valid hex code.')
             return None
 
-        for range in self.config.ac_countries:
-            if icao_code_hex >= int(range['start'], 16) and icao_code_hex <= int(range['end'], 16):
-                return self.get_country_id(range['country'])
+        country_id: Optional[str]
+        found, country_id = self.get_country_index().lookup(icao_code_hex)
+        if not found:
+            self.logger.error(f'icao code {ac_icao} is not in the range of ac_countries.json.')
+
+        return country_id
+
+    def get_countries(self, ac_icaos: Sequence[str]) -> List[Optional[str]]:
+        country_ids: List[Optional[str]] = self.get_country_index().lookup_many(ac_icaos)
+        return country_ids
+
+    def get_airport_index(self) -> AirportIndex:
+        if self.config.airport_index is None or self.config.airport_index.is_stale():
+            airports = crud.get_airports(self.get_db())
+
+            # Existing databases only have the airports of their routes until the next
+            # VirtualRadar import.
+            if not airports:
+                result = crud.backfill_airports_from_routes(self.get_db())
+                self.logger.info(f'Stored {result.inserted} airports of routes in airportdata')
+                airports = crud.get_airports(self.get_db())
+
+            self.config.airport_index = AirportIndex(airports)
+
+        return self.config.airport_index
+
+    def update_route_airport_data(self, route: Route) -> None:
+        """Fills in the airports of a route from the airport index."""
+        airports = self.get_airport_index()
+        dep_airport = airports.get(route.dep_icao, route.dep_iata)
+        arr_airport = airports.get(route.arr_icao, route.arr_iata)
+
+        if dep_airport is not None:
+            route.dep_airport = dep_airport.name
+            route.dep_icao = dep_airport.icao
+            route.dep_iata = dep_airport.iata
+            route.dep_loc = dep_airport.location
+            route.dep_country = dep_airport.country
+            route.dep_country_id = dep_airport.country_id
+            route.dep_lat = dep_airport.lat
+            route.dep_lon = dep_airport.lon
+            route.dep_alt = dep_airport.alt
+
+        if arr_airport is not None:
+            route.arr_airport = arr_airport.name
+            route.arr_icao = arr_airport.icao
+            route.arr_iata = arr_airport.iata
+            route.arr_loc = arr_airport.location
+            route.arr_country = arr_airport.country
+            route.arr_country_id = arr_airport.country_id
+            route.arr_lat = arr_airport.lat
+            route.arr_lon = arr_airport.lon
+            route.arr_alt = arr_airport.alt
+
+    def search(self, query: str, limit: int = 10) -> Optional[List[SearchResult]]:
+        """
+        Searches callsigns, registrations, hex codes and airline names by prefix in the search
+        index. Returns None until the index is built in a background job.
+        """
+        index = self.config.search_index
+        if index is None or index.is_stale():
+            self.config.background_jobs.submit('search_index', self.build_search_index)
+
+        if index is None:
+            return None
 
-        self.logger.error(f'icao code {ac_icao} is not in the range of ac_countries.json.')
-        return None
+        results: List[SearchResult] = index.search(query, limit)
+        return results
+
+    def build_search_index(self) -> None:
+        started = time.monotonic()
+        with SessionLocal() as db:
+            routes, aircraft, airlines = crud.get_search_keys(db)
+
+        self.config.search_index = SearchIndex(routes, aircraft, airlines)
+        self.logger.info(
+            f'Built search index of {len(self.config.search_index)} keys '
+            f'in {time.monotonic() - started:.1f}s'
+        )
 
     def store_realtime_entry(self) -> None:
         data = self.get_statistics()
@@ -0,0 +1,70 @@
+from typing import Optional
+
+import httpx
+import requests
+from database import Database
+from responses import DUMP1090Response
+
+
+class DUMP1090Client:
+    """
+    Fetches the current aircraft from dump1090.
+    Connections are kept alive between polls, so concurrent clients share a small pool.
+    """
+
+    def __init__(self, address: Optional[str] = None, timeout: float = 2.0) -> None:
+        address = address or Database.DUMP1090_ADDRESS or 'http://localhost:8080'
+        if '://' not in address:
+            address = f'http://{address}'
+
+        self.aircraft_url = f'{address.rstrip("/")}/data/aircraft.json'
+        self.receiver_url = f'{address.rstrip("/")}/data/receiver.json'
+        self.timeout = httpx.Timeout(timeout, connect=1.0)
+        self.limits = httpx.Limits(max_connections=8, max_keepalive_connections=8)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._session = requests.Session()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+
+        return self._client
+
+    async def get_live_flights(self) -> DUMP1090Response:
+        try:
+            response = await self._get_client().get(self.aircraft_url)
+        except httpx.HTTPError as e:
+            raise ConnectionError('Could not connect to dump1090') from e
+
+        if not response.is_success:
+            raise ConnectionError('Could not connect to dump1090')
+
+        return DUMP1090Response.parse_obj(response.json())
+
+    async def get_refresh_interval(self, default: float = 1.0) -> float:
+        """Returns the interval in seconds at which dump1090 rewrites aircraft.json."""
+        try:
+            response = await self._get_client().get(self.receiver_url)
+            return float(response.json()['refresh']) / 1000.0
+        except (httpx.HTTPError, ValueError, KeyError):
+            return default
+
+    def get_live_flights_sync(self) -> DUMP1090Response:
+        try:
+            response = self._session.get(
+                self.aircraft_url, timeout=(self.timeout.connect, self.timeout.read)
+            )
+        except requests.RequestException as e:
+            raise ConnectionError('Could not connect to dump1090') from e
+
+        if not response.ok:
+            raise ConnectionError('Could not connect to dump1090')
+
+        return DUMP1090Response.parse_obj(response.json())
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+        self._session.close()
@@ -1,11 +1,12 @@
 import os
-import random
 from typing import Any, Dict, List
 
 import crud
-import requests
+from batch_session import BatchSession
 from conversion import google_flight_to_aircraft, google_flight_to_route
+from http_client import http_client
 from logger import get_logger
+from models import Aircraft, Route, WorkKind
 from responses import GoogleFlightMetaTag, GoogleFlightResponse
 
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
@@ -27,7 +28,7 @@ class Google:
             'Accept': 'application/json',
         }
 
-        api_response = requests.get(
+        api_response = http_client.get(
             f'https://www.googleapis.com/customsearch/v1/', params=params, headers=headers
         )
         json_response = dict(api_response.json())
@@ -53,7 +54,7 @@ class Google:
 
         return metatags[highest[0]]
 
-    def get_flights_by_icao(self, flight_icao: str) -> None:
+    def get_flights_by_icao(self, flight_icao: str, batch: BatchSession) -> None:
         api_response = self._send_request({'q': flight_icao})
 
         if api_response == {}:
@@ -62,12 +63,12 @@ class Google:
         flights: GoogleFlightResponse = GoogleFlightResponse.parse_obj(api_response)
         if flights.items is not None:
             best_flight = self.get_best_flight([x.pagemap.metatags[0] for x in flights.items])
-            crud.update_route(self.db, google_flight_to_route(best_flight, flight_icao))
+            batch.add(Route, [google_flight_to_route(best_flight, flight_icao)], ['icao'])
             self.logger.info(f'Stored flight from Google ({flight_icao})')
         else:
             self.logger.info(f'Could not find flight from Google ({flight_icao})')
 
-    def get_aircraft_by_icao(self, ac_icao: str, ac_registration: str) -> None:
+    def get_aircraft_by_icao(self, ac_icao: str, ac_registration: str, batch: BatchSession) -> None:
         api_response = self._send_request({'q': ac_registration})
 
         if api_response == {}:
@@ -76,10 +77,10 @@ class Google:
         aircraft_list: GoogleFlightResponse = GoogleFlightResponse.parse_obj(api_response)
         if aircraft_list.items is not None:
             best_flight = self.get_best_flight([x.pagemap.metatags[0] for x in aircraft_list.items])
-            crud.update_aircraft(
-                self.db,
-                google_flight_to_aircraft(best_flight, self.adsbdata, ac_icao, ac_registration),
+            aircraft = google_flight_to_aircraft(
+                best_flight, self.adsbdata, ac_icao, ac_registration
             )
+            batch.add(Aircraft, [aircraft], ['icao'])
             self.logger.info(f'Stored aircraft from Google ({ac_registration})')
         else:
             self.logger.info(f'Could not find aircraft from Google ({ac_registration})')
@@ -87,46 +88,33 @@ class Google:
     def store_missing_flight_data(self) -> None:
         self.logger.info('Storing missing flight data from Google...')
         max_items = 4
-        rows_to_delete = []
 
-        with open(self.config.routes_to_update_path, 'r') as f:
-            lines = f.readlines()
-            max_items = min(max_items, len(lines))
+        routes = crud.get_pending_work_items(self.db, WorkKind.route, limit=max_items)
 
-        for _ in range(max_items):
-            flight_number = random.choice(lines).strip()
-            rows_to_delete.append(flight_number)
+        with BatchSession(self.db) as batch:
+            for route in routes:
+                self.get_flights_by_icao(route.key, batch)
 
-            self.get_flights_by_icao(flight_icao=flight_number)
-
-        # Delete flights that could not be found.
-        lines = [x for x in lines if x.strip() not in rows_to_delete]
-        with open(self.config.routes_to_update_path, 'w') as fw:
-            fw.write('\n'.join(lines) + '\n')
+        crud.resolve_work_items(self.db)
+        crud.record_work_attempts(self.db, WorkKind.route, [x.key for x in routes], 'google')
 
         self.logger.info('Missing flight data from Google is stored.')
 
     def store_missing_aircraft_data(self) -> None:
         self.logger.info('Storing missing aircraft data from Google...')
         max_items = 4
-        rows_to_delete = []
-
-        with open(self.config.aircraft_to_update_path, 'r') as f:
-            lines = [x.strip() for x in f.readlines()]
-            reg_lines = [x for x in lines if ' ' in x]
-            max_items = min(max_items, len(reg_lines))
 
-        for _ in range(max_items):
-            ac = random.choice(reg_lines).strip()
-            ac_icao = ac.split(' ')[0]
-            ac_registration = ac.split(' ')[1]
-            rows_to_delete.append(ac)
+        aircraft_list = crud.get_pending_work_items(
+            self.db, WorkKind.aircraft, limit=max_items, with_registration=True
+        )
 
-            self.get_aircraft_by_icao(ac_icao, ac_registration)
+        with BatchSession(self.db) as batch:
+            for aircraft in aircraft_list:
+                self.get_aircraft_by_icao(aircraft.key, aircraft.registration, batch)
 
-        # Delete aircraft that could not be found.
-        lines = [x for x in lines if x not in rows_to_delete]
-        with open(self.config.aircraft_to_update_path, 'w') as fw:
-            fw.write('\n'.join(lines) + '\n')
+        crud.resolve_work_items(self.db)
+        crud.record_work_attempts(
+            self.db, WorkKind.aircraft, [x.key for x in aircraft_list], 'google'
+        )
 
         self.logger.info('Missing aircraft data from Google is stored.')
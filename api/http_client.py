@@ -0,0 +1,206 @@
+import math
+import random
+import threading
+import time
+from typing import AbstractSet, Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from logger import get_logger
+from requests.adapters import HTTPAdapter
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class LatencyHistogram:
+    """
+    Counts request latencies in fixed buckets, so percentiles can be reported without keeping
+    every sample. Percentiles are the upper bound of the bucket they fall in.
+    """
+
+    buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[next(i for i, bound in enumerate(self.buckets) if seconds <= bound)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, fraction: float) -> float:
+        if self.count == 0:
+            return 0.0
+
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return self.buckets[-1]
+
+    def get_statistics(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+class UpstreamHost:
+    """The keep-alive connections, concurrency cap and statistics of one upstream host."""
+
+    def __init__(self, max_connections: int) -> None:
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.semaphore = threading.BoundedSemaphore(max_connections)
+        self.latency = LatencyHistogram()
+        self.retries = 0
+        self.failures = 0
+
+    def get_statistics(self) -> Dict[str, Any]:
+        return {**self.latency.get_statistics(), 'retries': self.retries, 'failures': self.failures}
+
+
+class HTTPClient:
+    """
+    Sends the requests to the upstream APIs (AviationStack, Schiphol, Google, image and logo
+    hosts) over one pool of keep-alive connections per host, instead of a new connection and
+    TLS handshake for every request.
+
+    At most `max_connections` requests run at the same time per host. Connection errors,
+    timeouts and 5xx responses are retried with exponential backoff and full jitter, or after
+    the Retry-After of the response. A 429 is only retried when it has a Retry-After, without
+    one it is usually a used up quota, which a retry cannot fix. When the retries run out, the
+    last response is returned, or the last exception is raised.
+    """
+
+    logger = get_logger('http_client')
+
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        timeout: Timeout = (3.05, 15.0),
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 10.0,
+        max_connections: int = 4,
+    ) -> None:
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_connections = max_connections
+        self._hosts: Dict[str, UpstreamHost] = {}
+        self._lock = threading.Lock()
+
+    def _get_host(self, url: str) -> Tuple[str, UpstreamHost]:
+        host = urlsplit(url).netloc
+
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = UpstreamHost(self.max_connections)
+
+            return host, self._hosts[host]
+
+    def _should_retry(self, response: requests.Response, retry_statuses: AbstractSet[int]) -> bool:
+        if response.status_code == 429:
+            return 429 in retry_statuses and 'Retry-After' in response.headers
+
+        return response.status_code in retry_statuses
+
+    def _get_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def get(
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, Any]] = None,
+        stream: bool = False,
+        timeout: Optional[Timeout] = None,
+        retries: Optional[int] = None,
+        retry_statuses: Optional[AbstractSet[int]] = None,
+    ) -> requests.Response:
+        """
+        Sends a GET request. With `stream` the body is read by the caller, after the
+        concurrency slot was given back, and the latency is the time until the headers.
+        """
+        host, upstream = self._get_host(url)
+        retries = self.retries if retries is None else retries
+        retry_statuses = self.retry_statuses if retry_statuses is None else retry_statuses
+        attempt = 0
+
+        while True:
+            response: Optional[requests.Response] = None
+
+            try:
+                with upstream.semaphore:
+                    started = time.monotonic()
+                    try:
+                        response = upstream.session.get(
+                            url,
+                            params=params,
+                            headers=headers,
+                            stream=stream,
+                            timeout=timeout or self.timeout,
+                        )
+                    finally:
+                        upstream.latency.record(time.monotonic() - started)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= retries:
+                    upstream.failures += 1
+                    raise
+
+            if response is not None and (
+                not self._should_retry(response, retry_statuses) or attempt >= retries
+            ):
+                if not response.ok:
+                    upstream.failures += 1
+
+                return response
+
+            delay = self._get_delay(attempt, response)
+            self.logger.warning(
+                f'Retrying {host} in {delay:.1f}s, '
+                f'{response.status_code if response is not None else "no response"}'
+            )
+            if response is not None:
+                response.close()
+
+            upstream.retries += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def get_statistics(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            hosts: List[Tuple[str, UpstreamHost]] = list(self._hosts.items())
+
+        return {host: upstream.get_statistics() for host, upstream in hosts}
+
+    def close(self) -> None:
+        with self._lock:
+            for upstream in self._hosts.values():
+                upstream.session.close()
+
+            self._hosts.clear()
+
+
+# Process-wide client, shared by all integrations so they share their connections per host.
+http_client = HTTPClient()
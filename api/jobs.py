@@ -0,0 +1,62 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Set
+
+from logger import get_logger
+from lookup_cache import TTLCache
+
+
+class BackgroundJobs:
+    """
+    Runs slow upstream fetches (aircraft images, airline logos) in a bounded pool of threads.
+    A job with the same key is queued only once until it has finished. A job that failed is not
+    queued again for `failed_retry_after` seconds, so an upstream that keeps timing out is not
+    asked again for every snapshot.
+    """
+
+    logger = get_logger('jobs')
+
+    def __init__(
+        self, max_workers: int = 4, max_pending: int = 256, failed_retry_after: float = 300.0
+    ) -> None:
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='jobs')
+        self._pending: Set[str] = set()
+        self._failed: TTLCache[bool] = TTLCache(
+            max_size=10000, ttl=failed_retry_after, negative_ttl=0
+        )
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, fn: Callable[..., Any], *args: Any) -> bool:
+        """
+        Queues `fn(*args)`, returns False if the job is already queued, failed recently or the
+        queue is full.
+        """
+        with self._lock:
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                return False
+
+            failed, _ = self._failed.lookup(key)
+            if failed:
+                return False
+
+            self._pending.add(key)
+
+        self._executor.submit(self._run, key, fn, *args)
+        return True
+
+    def _run(self, key: str, fn: Callable[..., Any], *args: Any) -> None:
+        try:
+            fn(*args)
+        except Exception:
+            self.logger.exception(f'Job {key} failed')
+            self._failed.put(key, True)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def get_pending_count(self) -> int:
+        return len(self._pending)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,98 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from logger import get_logger
+
+
+class KeyPool:
+    """
+    The API keys of an upstream with a monthly request quota, e.g. AviationStack.
+
+    Requests are counted per key and month, and a key that the upstream reported as exhausted
+    is not used again until the next month. The counts are persisted to `path`, so they survive
+    restarts. Keys are stored by their hash, the file does not contain the keys themselves.
+
+    Processes that share the file (the API and the CLI jobs) read, update and write it under a
+    file lock, so they add to each other's counts instead of overwriting them.
+    """
+
+    logger = get_logger('key_pool')
+
+    def __init__(self, keys: List[str], path: str, monthly_limit: int) -> None:
+        self.keys = [key for key in keys if key and key != 'None']
+        self.path = path
+        self.monthly_limit = monthly_limit
+        self.usage: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def _get_key_id(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+    def _get_usage(self, key: str) -> Dict[str, Any]:
+        month = datetime.utcnow().strftime('%Y-%m')
+        usage = self.usage.get(self._get_key_id(key))
+
+        # Quotas reset every month.
+        if usage is None or usage['month'] != month:
+            usage = {'month': month, 'used': 0, 'exhausted': False}
+            self.usage[self._get_key_id(key)] = usage
+
+        return usage
+
+    def _get_remaining(self, key: str) -> int:
+        usage = self._get_usage(key)
+        return 0 if usage['exhausted'] else max(self.monthly_limit - usage['used'], 0)
+
+    def get_remaining(self) -> int:
+        """Returns the number of requests that all keys together have left this month."""
+        with self._locked():
+            return sum(self._get_remaining(key) for key in self.keys)
+
+    def acquire(self) -> Optional[str]:
+        """Counts a request on the key with the most requests left, None if all are used up."""
+        with self._locked():
+            if not self.keys:
+                return None
+
+            key = max(self.keys, key=self._get_remaining)
+            if self._get_remaining(key) == 0:
+                return None
+
+            self._get_usage(key)['used'] += 1
+            self._save()
+            return key
+
+    def mark_exhausted(self, key: str) -> None:
+        with self._locked():
+            self._get_usage(key)['exhausted'] = True
+            self._save()
+
+        self.logger.warning(f'Key {self._get_key_id(key)} is exhausted until next month')
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Holds the lock of this process and of the file, with the usage read from the file."""
+        with self._lock, open(f'{self.path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._load()
+            yield
+
+    def _load(self) -> None:
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.usage = json.load(f)
+
+    def _save(self) -> None:
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.usage, f, indent=2, sort_keys=True)
+
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,320 @@
+import asyncio
+import json
+import secrets
+from collections import deque
+from typing import (
+    Any,
+    AsyncIterator,
+    Deque,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from data import ADSBData
+from database import SessionLocal
+from logger import get_logger
+from responses import DUMP1090Response
+from starlette.concurrency import run_in_threadpool
+
+AircraftFields = Dict[str, Dict[str, Any]]
+
+
+class BoundingBox(NamedTuple):
+    lat_min: float
+    lon_min: float
+    lat_max: float
+    lon_max: float
+
+    def contains(self, fields: Dict[str, Any]) -> bool:
+        lat, lon = fields.get('lat'), fields.get('lon')
+        if lat is None or lon is None:
+            return False
+
+        return bool(self.lat_min <= lat <= self.lat_max and self.lon_min <= lon <= self.lon_max)
+
+
+class Subscriber:
+    """A client of the push channel, which is notified of the seq of every new snapshot."""
+
+    # Sent instead of a seq to end the stream of a subscriber that could not keep up.
+    disconnect = -1
+
+    def __init__(self, bbox: Optional[BoundingBox], max_pending: int) -> None:
+        self.bbox = bbox
+        self.queue: 'asyncio.Queue[int]' = asyncio.Queue(maxsize=max_pending)
+        self.last_seq: Optional[int] = None
+
+
+class LiveSnapshot:
+    """
+    Builds the enriched live flights once per dump1090 update and keeps the serialized JSON,
+    so the cost of /liveflights depends on the refresh rate of dump1090 instead of the viewers.
+
+    Clients see a seq as a token that includes a random epoch of this process. The counter
+    starts at 0 again after a restart and differs per worker, so a token of another epoch
+    gets a full snapshot instead of a 304 or a delta against a snapshot it never had.
+    """
+
+    logger = get_logger('live')
+
+    # Number of previous snapshots that clients can request a delta against.
+    history_size = 60
+
+    # Subscribers that have this many snapshots queued are considered too slow and disconnected.
+    max_pending = 10
+    max_subscribers = 1000
+    keep_alive_interval = 15.0
+    # Seconds that EventSource waits before it reconnects when all subscriber slots are taken.
+    full_retry_interval = 30.0
+
+    def __init__(self, config: Any) -> None:
+        self.config = config
+        self.interval = 1.0
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.body: Optional[bytes] = None
+        self.now: Optional[float] = None
+        self.aircraft_count = 0
+        self._history: Deque[Tuple[int, AircraftFields]] = deque(maxlen=self.history_size)
+        self._deltas: Dict[int, bytes] = {}
+        self._subscribers: Set[Subscriber] = set()
+        self._ready: Optional[asyncio.Event] = None
+        self._task: Optional['asyncio.Task[None]'] = None
+
+    def start(self) -> None:
+        self._ready = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+            self._task = None
+
+    async def _run(self) -> None:
+        self.interval = await self.config.dump1090.get_refresh_interval()
+        self.logger.info(f'Refreshing live flights every {self.interval:.1f}s')
+        loop = asyncio.get_event_loop()
+
+        while True:
+            started = loop.time()
+            try:
+                await self.refresh()
+            except ConnectionError as e:
+                self.logger.warning(e)
+            except Exception:
+                self.logger.exception('Could not refresh live flights')
+
+            await asyncio.sleep(max(0.0, self.interval - (loop.time() - started)))
+
+    async def refresh(self) -> None:
+        live_flights: DUMP1090Response = await self.config.dump1090.get_live_flights()
+
+        # dump1090 did not write a new aircraft.json since the previous poll.
+        if live_flights.now is not None and live_flights.now == self.now:
+            return
+
+        seq = self.seq + 1
+        aircraft, body = await run_in_threadpool(self._build, live_flights, seq)
+
+        self.seq = seq
+        self.body = body
+        self.now = live_flights.now
+        self.aircraft_count = len(aircraft)
+        self._history.append((seq, aircraft))
+        self._deltas = {}
+
+        assert self._ready is not None
+        self._ready.set()
+        self._publish()
+
+    def _build(self, live_flights: DUMP1090Response, seq: int) -> Tuple[AircraftFields, bytes]:
+        with SessionLocal() as db:
+            data = ADSBData(db, self.config)
+            enriched: DUMP1090Response = data.enrich_live_flights(live_flights)
+
+        aircraft = {ac.hex: ac.dict() for ac in enriched}
+        body = {
+            'seq': self.get_token(seq),
+            'now': enriched.now,
+            'aircraft': list(aircraft.values()),
+        }
+        return aircraft, self._serialize(body)
+
+    @staticmethod
+    def _serialize(body: Dict[str, Any]) -> bytes:
+        return json.dumps(body, separators=(',', ':')).encode()
+
+    def get_token(self, seq: int) -> str:
+        return f'{self.epoch}-{seq}'
+
+    def parse_token(self, token: Optional[str]) -> Optional[int]:
+        """Returns the seq of a token of this epoch, None for any other token."""
+        epoch, _, seq = (token or '').partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+
+        return int(seq)
+
+    def get_etag(self) -> str:
+        return f'"{self.get_token(self.seq)}"'
+
+    def get_snapshot(self, bbox: Optional[BoundingBox] = None) -> Optional[bytes]:
+        if bbox is None or not self._history:
+            return self.body
+
+        aircraft = self._filter(self._history[-1][1], bbox)
+        return self._serialize(
+            {
+                'seq': self.get_token(self.seq),
+                'now': self.now,
+                'aircraft': list(aircraft.values()),
+            }
+        )
+
+    @staticmethod
+    def _filter(aircraft: AircraftFields, bbox: Optional[BoundingBox]) -> AircraftFields:
+        if bbox is None:
+            return aircraft
+
+        return {hex: fields for hex, fields in aircraft.items() if bbox.contains(fields)}
+
+    def get_delta(self, since: int, bbox: Optional[BoundingBox] = None) -> Optional[bytes]:
+        """
+        Returns the aircraft that were added, changed (only the changed fields) or removed since
+        snapshot `since`, or None if that snapshot is no longer in the history.
+        Aircraft that leave the bounding box are reported as removed.
+        """
+        if bbox is None and since in self._deltas:
+            return self._deltas[since]
+
+        previous = next((aircraft for seq, aircraft in self._history if seq == since), None)
+        if previous is None or since >= self.seq:
+            return None
+
+        previous = self._filter(previous, bbox)
+        current = self._filter(self._history[-1][1], bbox)
+        added: List[Dict[str, Any]] = []
+        changed: AircraftFields = {}
+
+        for hex, fields in current.items():
+            previous_fields = previous.get(hex)
+
+            if previous_fields is None:
+                added.append(fields)
+                continue
+
+            changed_fields = {
+                key: value for key, value in fields.items() if previous_fields.get(key) != value
+            }
+            if changed_fields:
+                changed[hex] = changed_fields
+
+        delta = self._serialize(
+            {
+                'seq': self.get_token(self.seq),
+                'since': self.get_token(since),
+                'now': self.now,
+                'added': added,
+                'changed': changed,
+                'removed': [hex for hex in previous if hex not in current],
+            }
+        )
+        if bbox is None:
+            self._deltas[since] = delta
+
+        return delta
+
+    def is_full(self) -> bool:
+        return len(self._subscribers) >= self.max_subscribers
+
+    def subscribe(self, bbox: Optional[BoundingBox] = None) -> Optional[Subscriber]:
+        if self.is_full():
+            return None
+
+        subscriber = Subscriber(bbox, self.max_pending)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.discard(subscriber)
+
+    def _publish(self) -> None:
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(self.seq)
+            except asyncio.QueueFull:
+                self.logger.info('Disconnecting a subscriber that cannot keep up')
+                self.unsubscribe(subscriber)
+
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+
+                subscriber.queue.put_nowait(Subscriber.disconnect)
+
+    async def stream(
+        self, bbox: Optional[BoundingBox], since: Optional[str]
+    ) -> AsyncIterator[bytes]:
+        """
+        Yields server-sent events for a new subscriber: the full snapshot first (or a delta
+        against the token `since` when resuming), then a delta for every new snapshot.
+
+        The subscriber is only added once the response is streamed, so a client that is gone
+        before that does not keep a slot.
+        """
+        subscriber = self.subscribe(bbox)
+        if subscriber is None:
+            # The slots filled up after the endpoint checked is_full(). Without a retry field,
+            # EventSource would reconnect to the empty stream right away, in a loop.
+            yield b'retry: %d\n\n' % (self.full_retry_interval * 1000)
+            return
+
+        subscriber.last_seq = self.parse_token(since)
+
+        try:
+            if await self.get_body() is not None:
+                yield self._get_event(subscriber)
+
+            while True:
+                try:
+                    seq = await asyncio.wait_for(subscriber.queue.get(), self.keep_alive_interval)
+                except asyncio.TimeoutError:
+                    yield b': keep-alive\n\n'
+                    continue
+
+                if seq == Subscriber.disconnect:
+                    break
+
+                if seq != subscriber.last_seq:
+                    yield self._get_event(subscriber)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def _get_event(self, subscriber: Subscriber) -> bytes:
+        body = None
+        if subscriber.last_seq is not None:
+            body = self.get_delta(subscriber.last_seq, subscriber.bbox)
+        if body is None:
+            body = self.get_snapshot(subscriber.bbox)
+
+        assert body is not None
+        subscriber.last_seq = self.seq
+        return b'id: %s\ndata: %s\n\n' % (self.get_token(self.seq).encode(), body)
+
+    async def get_body(self, timeout: float = 5.0) -> Optional[bytes]:
+        """Returns the latest snapshot, waits for the first one if it is not built yet."""
+        if self.body is None and self._ready is not None:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return self.body
@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Generic, Optional, Tuple, TypeVar
+
+from models import Aircraft, Route
+
+T = TypeVar('T')
+
+
+class TTLCache(Generic[T]):
+    """
+    Bounded in-process cache that evicts the least recently used entry when it is full.
+
+    Entries expire after `ttl` seconds. A value of `None` is stored as a negative entry, which
+    expires after `negative_ttl` seconds, so unknown keys do not hit the database every poll.
+    """
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[str, Tuple[float, Optional[T]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key: str) -> Tuple[bool, Optional[T]]:
+        """Returns whether the key was found and its (possibly negative) value."""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key: str, value: Optional[T]) -> None:
+        ttl = self.ttl if value is not None else self.negative_ttl
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_statistics(self) -> Dict[str, int]:
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+# Process-wide caches, rows are cached detached from the session that loaded them. The rows are
+# shared by all threads, so they are read-only: writes go to the database and invalidate them.
+# Writes through crud invalidate the rows of this process only. Rows that the collector or cli
+# write in another process are picked up when the cached entry expires, so the ttl is also the
+# longest time the API serves a row that was changed elsewhere.
+aircraft_cache: TTLCache[Aircraft] = TTLCache(max_size=20000, ttl=600, negative_ttl=60)
+route_cache: TTLCache[Route] = TTLCache(max_size=20000, ttl=600, negative_ttl=60)
@@ -4,18 +4,21 @@ import crud
 import models
 from config import Config
 from data import ADSBData
-from database import SessionLocal, engine
-from fastapi import FastAPI, Query, Response
+from database import SessionLocal, async_engine, create_tables, get_async_db
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.params import Depends
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.inmemory import InMemoryBackend
 from fastapi_cache.decorator import cache
-from responses import DUMP1090Response
+from http_client import http_client
+from live import BoundingBox, LiveSnapshot
+from responses import SearchResult
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from starlette.middleware.cors import CORSMiddleware
 from starlette.responses import FileResponse, StreamingResponse
 
-models.Base.metadata.create_all(bind=engine)
+create_tables()
 
 
 app = FastAPI(
@@ -33,6 +36,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
 # Dependency
 def get_db() -> Session:
     db = SessionLocal()
@@ -48,15 +52,61 @@ async def get_cache() -> int:
 
 
 config = Config()
+live_snapshot = LiveSnapshot(config)
 
 
 @app.get(
     '/liveflights',
     summary="Get currently detected flights",
 )
-async def liveflights(db: Session = Depends(get_db)) -> DUMP1090Response:
-    data = ADSBData(db, config)
-    return data.get_live_flights()
+async def liveflights(
+    request: Request,
+    since: Optional[str] = Query(
+        None,
+        description='Only return the aircraft that were added, changed or removed since this seq',
+    ),
+) -> Response:
+    body = await live_snapshot.get_body()
+    if body is None:
+        raise HTTPException(status_code=503, detail='Live flights are not available yet')
+
+    etag = live_snapshot.get_etag()
+    # A seq of another process or of before a restart is None, and gets the full snapshot.
+    since_seq = live_snapshot.parse_token(since)
+    if request.headers.get('if-none-match') == etag or since_seq == live_snapshot.seq:
+        return Response(status_code=304, headers={'ETag': etag})
+
+    if since_seq is not None:
+        # Fall back to the full snapshot if `since` is too old.
+        body = live_snapshot.get_delta(since_seq) or body
+
+    return Response(content=body, media_type='application/json', headers={'ETag': etag})
+
+
+@app.get(
+    '/liveflights/stream',
+    summary="Stream changes of the currently detected flights as server-sent events",
+)
+async def liveflights_stream(
+    request: Request,
+    lat_min: Optional[float] = Query(None, description='Only stream aircraft in this box'),
+    lon_min: Optional[float] = None,
+    lat_max: Optional[float] = None,
+    lon_max: Optional[float] = None,
+) -> StreamingResponse:
+    bbox = None
+    if lat_min is not None and lon_min is not None and lat_max is not None and lon_max is not None:
+        bbox = BoundingBox(lat_min, lon_min, lat_max, lon_max)
+
+    if live_snapshot.is_full():
+        raise HTTPException(status_code=503, detail='Too many subscribers')
+
+    # Browsers send the id of the last received event when they reconnect.
+    return StreamingResponse(
+        live_snapshot.stream(bbox, request.headers.get('last-event-id')),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
 
 @app.get(
@@ -64,21 +114,64 @@ async def liveflights(db: Session = Depends(get_db)) -> DUMP1090Response:
     summary="Get flight data",
 )
 @cache(expire=60)
-async def statistics(db: Session = Depends(get_db)) -> Dict[str, Any]:
-    data = ADSBData(db, config)
-    statistics: Dict[str, Any] = data.get_statistics()
+async def statistics(db: AsyncSession = Depends(get_async_db)) -> Dict[str, Any]:
+    data = ADSBData.without_db(config)
+    statistics: Dict[str, Any] = await data.get_statistics_async(db, live_snapshot.aircraft_count)
     return statistics
 
 
+@app.get(
+    '/cache_statistics',
+    summary="Get hit and miss counts of the aircraft and route caches",
+)
+async def cache_statistics() -> Dict[str, Dict[str, int]]:
+    data = ADSBData.without_db(config)
+    cache_statistics: Dict[str, Dict[str, int]] = data.get_cache_statistics()
+    return cache_statistics
+
+
+@app.get(
+    '/upstream_statistics',
+    summary="Get latency histograms, retries and failures of the upstream APIs per host",
+)
+async def upstream_statistics() -> Dict[str, Dict[str, Any]]:
+    upstream_statistics: Dict[str, Dict[str, Any]] = http_client.get_statistics()
+    return upstream_statistics
+
+
+@app.get(
+    '/search',
+    summary="Search callsigns, registrations, hex codes and airline names by prefix",
+)
+async def search(
+    q: str, limit: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_async_db)
+) -> List[SearchResult]:
+    data = ADSBData.without_db(config)
+    results: Optional[List[SearchResult]] = data.search(q, limit)
+
+    # The search index is not built yet.
+    if results is None:
+        results = await crud.search_by_prefix_async(db, q, limit)
+
+    return results
+
+
 @app.get(
     '/routes',
     summary="Get route data",
 )
 @cache(expire=60)
 async def routes(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = Query(None, description='The icao of the last route of a page'),
+    airline: Optional[str] = Query(None, description='ICAO or IATA code of the airline'),
+    airport: Optional[str] = Query(None, description='ICAO or IATA code of an airport'),
+    db: AsyncSession = Depends(get_async_db),
 ) -> List[models.Route]:
-    routes: List[models.Route] = crud.get_routes_paginated(db, skip, limit)
+    routes: List[models.Route] = await crud.get_routes_paginated_async(
+        db, skip, limit, after, airline, airport
+    )
     return routes
 
 
@@ -88,9 +181,18 @@ async def routes(
 )
 @cache(expire=60)
 async def aircraft(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = Query(None, description='The icao of the last aircraft of a page'),
+    airline: Optional[str] = Query(None, description='IATA code of the airline'),
+    country: Optional[str] = Query(None, description='ISO 3166 alpha-2 country code'),
+    type: Optional[str] = Query(None, description='ICAO aircraft type designator'),
+    category: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
 ) -> List[models.Aircraft]:
-    aircraft: List[models.Aircraft] = crud.get_aircraft_paginated(db, skip, limit)
+    aircraft: List[models.Aircraft] = await crud.get_aircraft_paginated_async(
+        db, skip, limit, after, airline, country, type, category
+    )
     return aircraft
 
 
@@ -103,9 +205,8 @@ async def ac_icon(
     adsb_category: str = None,
     color: str = None,
     is_selected: bool = False,
-    db: Session = Depends(get_db),
 ) -> Response:
-    data = ADSBData(db, config)
+    data = ADSBData.without_db(config)
     icon_svg = data.get_ac_icon(category, adsb_category, color, is_selected)
     return Response(content=icon_svg, media_type="image/svg+xml")
 
@@ -114,8 +215,9 @@ async def ac_icon(
     '/airline_icon.svg',
     summary="Get icon of an airline",
 )
-async def airline_icon(iata: str = 'KL', db: Session = Depends(get_db)) -> Optional[FileResponse]:
-    data = ADSBData(db, config)
+# Not async, a logo that is not cached yet is downloaded, which Starlette runs in its threadpool.
+def airline_icon(iata: str = 'KL') -> Optional[FileResponse]:
+    data = ADSBData.without_db(config)
     icon_png = data.get_airline_icon(iata)
     if icon_png is not None:
         return FileResponse(icon_png)
@@ -127,7 +229,9 @@ async def airline_icon(iata: str = 'KL', db: Session = Depends(get_db)) -> Optio
     '/image',
     summary="Get aircraft image",
 )
-async def image(
+# Not async, it reads the aircraft with the sync session and may download the image, which
+# Starlette runs in its threadpool instead of on the event loop.
+def image(
     icao: str = Query(None, title='test', description='ICAO hex code of aircraft'),
     i: int = Query(0, description='index of the image'),
     as_thumbnail: bool = Query(False, description='Load as thumbnail or as full image'),
@@ -147,3 +251,13 @@ async def image(
 @app.on_event("startup")
 async def startup() -> None:
     FastAPICache.init(InMemoryBackend(), prefix="fastapi-cache")
+    live_snapshot.start()
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await live_snapshot.stop()
+    config.background_jobs.shutdown()
+    await config.dump1090.close()
+    http_client.close()
+    await async_engine.dispose()
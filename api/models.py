@@ -1,5 +1,16 @@
+from enum import Enum
+
 from database import Base
-from sqlalchemy import Boolean, Column, Integer, String
+from sqlalchemy import (
+    JSON,
+    Boolean,
+    Column,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+    func,
+)
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql.sqltypes import DateTime, Float, Time
 
@@ -17,6 +28,22 @@ class AircraftImage(Base):
 
 class Aircraft(Base):
     __tablename__ = "aircraftdata"
+    # The filters of /aircraft, with the primary key for keyset pagination.
+    __table_args__ = (
+        Index('ix_aircraftdata_airline_iata_icao', 'airline_iata', 'icao'),
+        Index('ix_aircraftdata_country_icao', 'country', 'icao'),
+        Index('ix_aircraftdata_aircrafttype_icao', 'aircrafttype', 'icao'),
+        Index('ix_aircraftdata_category_icao', 'category', 'icao'),
+        # Prefix searches (LIKE 'PH-%') cannot use the default btree indexes in most locales.
+        Index(
+            'ix_aircraftdata_icao_pattern', 'icao', postgresql_ops={'icao': 'varchar_pattern_ops'}
+        ),
+        Index(
+            'ix_aircraftdata_registration_pattern',
+            'registration',
+            postgresql_ops={'registration': 'varchar_pattern_ops'},
+        ),
+    )
 
     icao = Column(String, primary_key=True, index=True)
     registration = Column(String, index=True)
@@ -43,6 +70,16 @@ class Aircraft(Base):
 
 class Route(Base):
     __tablename__ = "routesdata"
+    # The filters of /routes, with the primary key for keyset pagination.
+    __table_args__ = (
+        Index('ix_routesdata_airline_icao_icao', 'airline_icao', 'icao'),
+        Index('ix_routesdata_airline_iata_icao', 'airline_iata', 'icao'),
+        Index('ix_routesdata_dep_icao_icao', 'dep_icao', 'icao'),
+        Index('ix_routesdata_dep_iata_icao', 'dep_iata', 'icao'),
+        Index('ix_routesdata_arr_icao_icao', 'arr_icao', 'icao'),
+        Index('ix_routesdata_arr_iata_icao', 'arr_iata', 'icao'),
+        Index('ix_routesdata_icao_pattern', 'icao', postgresql_ops={'icao': 'varchar_pattern_ops'}),
+    )
 
     icao = Column(String, primary_key=True, index=True)
     iata = Column(String)
@@ -72,6 +109,20 @@ class Route(Base):
     arr_country_id = Column(String)
 
 
+class Airport(Base):
+    __tablename__ = "airportdata"
+
+    icao = Column(String, primary_key=True, index=True)
+    iata = Column(String, index=True)
+    name = Column(String)
+    location = Column(String)
+    country = Column(String)
+    country_id = Column(String)
+    lat = Column(Float)
+    lon = Column(Float)
+    alt = Column(Float)
+
+
 class Airline(Base):
     __tablename__ = "airlinedata"
 
@@ -91,9 +142,48 @@ class Airline(Base):
     country_iso2 = Column(String)
 
 
+# The prefix search matches airline names case insensitively, upper() returns text.
+Index(
+    'ix_airlinedata_airline_name_upper_pattern',
+    func.upper(Airline.airline_name).label('airline_name_upper'),
+    postgresql_ops={'airline_name_upper': 'text_pattern_ops'},
+)
+
+
 class Realtime(Base):
     __tablename__ = "realtimedata"
 
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime, nullable=False)
-    data = Column(JSONB, nullable=False)
+    data = Column(JSON().with_variant(JSONB(), 'postgresql'), nullable=False)
+
+
+class WorkKind(str, Enum):
+    route = "route"
+    aircraft = "aircraft"
+
+
+class WorkStatus(str, Enum):
+    pending = "pending"
+    done = "done"
+    failed = "failed"
+
+
+class WorkItem(Base):
+    """A route (callsign) or aircraft (hex code) of which the details still have to be collected."""
+
+    __tablename__ = "work_queue"
+    __table_args__ = (
+        UniqueConstraint('kind', 'key', name='uq_work_queue_kind_key'),
+        Index('ix_work_queue_kind_status', 'kind', 'status'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    registration = Column(String)
+    status = Column(String, nullable=False, default=WorkStatus.pending.value)
+    source = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+    enqueued_at = Column(DateTime, nullable=False)
+    attempted_at = Column(DateTime)
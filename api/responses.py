@@ -10,10 +10,49 @@ class AircraftImagePayload(BaseModel):
     image_endpoint: str
 
 
+class RoutePayload(BaseModel):
+    icao: str
+    iata: Optional[str]
+    number: Optional[str]
+    airline_name: Optional[str]
+    airline_iata: Optional[str]
+    airline_icao: Optional[str]
+
+    dep_airport: Optional[str]
+    dep_icao: Optional[str]
+    dep_iata: Optional[str]
+    dep_lat: Optional[float]
+    dep_lon: Optional[float]
+    dep_alt: Optional[float]
+    dep_loc: Optional[str]
+    dep_country: Optional[str]
+    dep_country_id: Optional[str]
+
+    arr_airport: Optional[str]
+    arr_icao: Optional[str]
+    arr_iata: Optional[str]
+    arr_lat: Optional[float]
+    arr_lon: Optional[float]
+    arr_alt: Optional[float]
+    arr_loc: Optional[str]
+    arr_country: Optional[str]
+    arr_country_id: Optional[str]
+
+    class Config:
+        orm_mode = True
+
+
+class SearchResult(BaseModel):
+    kind: str
+    # The icao of a route or aircraft, or the IATA code of an airline.
+    id: str
+    text: str
+
+
 class DUMP1090Signal(BaseModel):
     hex: str
     flight: Optional[str]
-    route: Optional[Route]
+    route: Optional[RoutePayload]
     airline_icon: Optional[str]
     alt_baro: Optional[float]
     alt_geom: Optional[float]
@@ -57,6 +96,7 @@ class DUMP1090Signal(BaseModel):
 
 
 class DUMP1090Response(BaseModel):
+    now: Optional[float]
     aircraft: List[DUMP1090Signal]
 
     def __iter__(self) -> Iterator[DUMP1090Signal]:  # type: ignore
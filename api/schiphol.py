@@ -1,12 +1,16 @@
 import datetime as dt
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional
 
 import crud
 import pytz
-import requests
+from batch_session import BatchSession
 from conversion import schiphol_flight_to_route
+from http_client import http_client
 from logger import get_logger
+from lookup_cache import TTLCache
 from models import Route
 from responses import DUMP1090Response, SchipholFlight, SchipholFlightListResponse
 from simplejson.errors import JSONDecodeError
@@ -14,6 +18,15 @@ from simplejson.errors import JSONDecodeError
 SCHIPHOL_API_ID = os.getenv('SCHIPHOL_API_ID')
 SCHIPHOL_API_KEY = os.getenv('SCHIPHOL_API_KEY')
 
+# The time windows of get_nearby_flights are rounded down to this many minutes.
+NEARBY_WINDOW_MINUTES = 5
+
+# Responses of get_nearby_flights by endpoint and parameters. The once a minute track_aircraft
+# cycles of a window send the same parameters, so they reuse the pages of the first cycle.
+response_cache: TTLCache[Dict[str, Any]] = TTLCache(
+    max_size=256, ttl=NEARBY_WINDOW_MINUTES * 60, negative_ttl=0
+)
+
 
 class Schiphol:
     logger = get_logger('schiphol')
@@ -22,7 +35,29 @@ class Schiphol:
         self.adsbdata = data
         self.db = data.db
 
-    def _send_request(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    def _send_request(
+        self, endpoint: str, params: Dict[str, Any], cache: bool = False
+    ) -> Dict[str, Any]:
+        """
+        With `cache`, responses are reused for NEARBY_WINDOW_MINUTES. Only pass it for requests
+        whose params contain their time window, otherwise they would return stale flights.
+        """
+        if not cache:
+            return self._send_uncached_request(endpoint, params)
+
+        cache_key = f'{endpoint}?{json.dumps(params, sort_keys=True)}'
+        found, cached = response_cache.lookup(cache_key)
+        if found and cached is not None:
+            cached_response: Dict[str, Any] = cached
+            return cached_response
+
+        response = self._send_uncached_request(endpoint, params)
+        if response != {}:
+            response_cache.put(cache_key, response)
+
+        return response
+
+    def _send_uncached_request(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
         headers = {
             'Accept': 'application/json',
             'app_id': SCHIPHOL_API_ID,
@@ -30,13 +65,14 @@ class Schiphol:
             'ResourceVersion': 'v4',
         }
 
-        api_response = requests.get(
+        api_response = http_client.get(
             f'https://api.schiphol.nl/public-flights/{endpoint}', headers=headers, params=params
         )
         content = api_response.content
 
+        # Past the last page, the API responds without a body.
         if content == b'':
-            return {}
+            return {'flights': []}
 
         if not api_response.ok:
             self.logger.error(
@@ -57,26 +93,50 @@ class Schiphol:
             return ''
         return registration.replace('-', '').upper().strip()
 
-    def collect_flights(self, params: Dict[str, Any]) -> List[SchipholFlight]:
+    def _get_page(
+        self, params: Dict[str, Any], page: int, cache: bool = False
+    ) -> Optional[List[SchipholFlight]]:
+        """Returns the flights of a page, None if it could not be fetched."""
+        api_response = self._send_request('flights', {**params, 'page': page}, cache)
+
+        if api_response == {}:
+            return None
+
+        flights = SchipholFlightListResponse.parse_obj(api_response).flights
+        return [x for x in flights if x.prefixICAO]
+
+    def collect_flights(self, params: Dict[str, Any], cache: bool = False) -> List[SchipholFlight]:
+        """
+        Returns the flights of up to `max_page` pages, until the first empty page. After the
+        first page, the pages are fetched concurrently in waves of one page per connection.
+        A page that could not be fetched ends the result early, which is logged.
+        """
+        max_page = 10
+        wave = http_client.max_connections
         result: List[SchipholFlight] = []
         page = 0
-        max_page = 10
 
-        while page < max_page:
-            params['page'] = page
-            api_response = self._send_request('flights', params)
+        with ThreadPoolExecutor(max_workers=wave) as executor:
+            while page < max_page:
+                # The first page tells whether there are more, so it is fetched on its own.
+                pages = range(page, min(page + (wave if page else 1), max_page))
 
-            if api_response == {}:
-                break
+                for number, flights in zip(
+                    pages, executor.map(lambda x: self._get_page(params, x, cache), pages)
+                ):
+                    if flights is None:
+                        self.logger.error(
+                            f'Schiphol flights page {number} of {params} failed, '
+                            f'returning the {len(result)} flights of the pages before it'
+                        )
+                        return result
 
-            flights = SchipholFlightListResponse.parse_obj(api_response).flights
-            flights = [x for x in flights if x.prefixICAO]
+                    if len(flights) == 0:
+                        return result
 
-            if len(flights) == 0:
-                break
+                    result += flights
 
-            result += flights
-            page += 1
+                page = pages.stop
 
         return result
 
@@ -84,27 +144,32 @@ class Schiphol:
         params = {'sort': '+scheduleTime', 'airline': airline_icao}
         return self.collect_flights(params)
 
-    def get_nearby_flights(self) -> Optional[SchipholFlight]:
-        result = []
+    def get_nearby_flights(self) -> List[SchipholFlight]:
         now = dt.datetime.now().astimezone(pytz.timezone('Europe/Amsterdam'))
-        params = {
+        now = now.replace(
+            minute=now.minute - now.minute % NEARBY_WINDOW_MINUTES, second=0, microsecond=0
+        )
+        landing = {
             'sort': '+estimatedLandingTime',
             'searchDateTimeField': 'estimatedLandingTime',
             'fromDateTime': f'{now - dt.timedelta(minutes=10):%Y-%m-%dT%H:%M:%S}',
             'toDateTime': f'{now + dt.timedelta(hours=1):%Y-%m-%dT%H:%M:%S}',
         }
-
-        result += self.collect_flights(params)
-
-        params = {
+        departed = {
             'sort': '+actualOffBlockTime',
             'searchDateTimeField': 'actualOffBlockTime',
             'fromDateTime': f'{now - dt.timedelta(hours=1, minutes=30):%Y-%m-%dT%H:%M:%S}',
             'toDateTime': f'{now:%Y-%m-%dT%H:%M:%S}',
         }
 
-        result += self.collect_flights(params)
-        return result
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            return [
+                flight
+                for flights in executor.map(
+                    lambda params: self.collect_flights(params, cache=True), [landing, departed]
+                )
+                for flight in flights
+            ]
 
     def store_missing_flight_data(self) -> None:
         self.logger.info('Storing missing flight data from the Schiphol API...')
@@ -112,28 +177,37 @@ class Schiphol:
         nearby_flights = self.get_nearby_flights()
         updated_flights = []
 
-        assert nearby_flights
+        if not nearby_flights:
+            self.logger.warning('The Schiphol API returned no nearby flights')
+            return
 
-        for flight in flights:
-            if not flight.registration:
-                continue
+        # Nearby flights by registration, the first flight of a registration wins.
+        nearby_by_registration: Dict[str, SchipholFlight] = {}
+        for nearby_flight in nearby_flights:
+            registration = self.sanitize_registration(nearby_flight.aircraftRegistration)
+            if registration:
+                nearby_by_registration.setdefault(registration, nearby_flight)
 
-            for nearby_flight in nearby_flights:
-                if self.sanitize_registration(flight.registration) == self.sanitize_registration(
-                    nearby_flight.aircraftRegistration
-                ):
-                    route = schiphol_flight_to_route(nearby_flight)
+        with BatchSession(self.db) as batch:
+            for flight in flights:
+                if not flight.registration:
+                    continue
+
+                match = nearby_by_registration.get(self.sanitize_registration(flight.registration))
+                if match is None:
+                    continue
+
+                route = schiphol_flight_to_route(match)
 
-                    if flight.flight:
-                        route.icao = flight.flight
+                if flight.flight:
+                    route.icao = flight.flight
 
-                    crud.update_route(self.db, route)
-                    crud.update_route_airport_data(self.db, route)
-                    updated_flights.append(route)
+                self.adsbdata.update_route_airport_data(route)
+                batch.add(Route, [route], ['icao'])
+                updated_flights.append(route)
 
-                    # aircraft = schiphol_flight_to_aircraft(nearby_flight, flight.hex)
-                    # crud.update_aircraft(self.db, aircraft)
-                    break
+                # aircraft = schiphol_flight_to_aircraft(match, flight.hex)
+                # batch.add(Aircraft, [aircraft], ['icao'])
 
         self.logger.info('Updated flights: ' + ','.join([x.icao for x in updated_flights]))
 
@@ -147,5 +221,5 @@ class Schiphol:
         route = schiphol_flight_to_route(route)
         self.logger.info(route)
         route.icao = flight_icao
-        crud.update_route(self.db, route)
+        crud.bulk_upsert(self.db, Route, [route], ['icao'])
         return route
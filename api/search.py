@@ -0,0 +1,98 @@
+import time
+from bisect import bisect_left
+from enum import Enum
+from typing import Dict, Iterable, List, Tuple
+
+from responses import SearchResult
+
+
+class SearchKind(str, Enum):
+    route = "route"
+    aircraft = "aircraft"
+    airline = "airline"
+
+
+class PrefixIndex:
+    """
+    Sorted (key, value, text) entries of one kind, searched with a binary search on the prefix.
+    The text is what is shown for a match.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str, str]]) -> None:
+        rows = sorted(set(entries))
+        self.keys: List[str] = [key for key, _, _ in rows]
+        self.values: List[str] = [value for _, value, _ in rows]
+        self.texts: List[str] = [text for _, _, text in rows]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, prefix: str, limit: int) -> List[Tuple[str, str]]:
+        """Returns the (value, text) of up to `limit` entries whose key starts with `prefix`."""
+        result: List[Tuple[str, str]] = []
+        seen = set()
+        i = bisect_left(self.keys, prefix)
+
+        while i < len(self.keys) and len(result) < limit and self.keys[i].startswith(prefix):
+            # A registration can be found with and without its dash, return it only once.
+            if self.values[i] not in seen:
+                seen.add(self.values[i])
+                result.append((self.values[i], self.texts[i]))
+
+            i += 1
+
+        return result
+
+
+class SearchIndex:
+    """
+    Callsigns, registrations, hex codes and airline names in memory for autocomplete.
+    Keys are uppercase, registrations can also be found without their dash (PHBXA).
+    """
+
+    # The tables change through imports in other processes, so rebuild the index now and then.
+    max_age = 600.0
+
+    def __init__(
+        self,
+        routes: Iterable[str],
+        aircraft: Iterable[Tuple[str, str]],
+        airlines: Iterable[Tuple[str, str]],
+    ) -> None:
+        aircraft = list(aircraft)
+        registrations = [(reg.upper(), icao, reg) for icao, reg in aircraft if reg]
+
+        self.indexes: Dict[SearchKind, PrefixIndex] = {
+            SearchKind.route: PrefixIndex((icao, icao, icao) for icao in routes),
+            SearchKind.aircraft: PrefixIndex(
+                [(icao, icao, icao) for icao, _ in aircraft]
+                + registrations
+                + [
+                    (key.replace('-', ''), icao, reg)
+                    for key, icao, reg in registrations
+                    if '-' in key
+                ]
+            ),
+            SearchKind.airline: PrefixIndex(
+                (name.upper(), iata, name) for iata, name in airlines if name
+            ),
+        }
+        self.built_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return sum(len(index) for index in self.indexes.values())
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.built_at > self.max_age
+
+    def search(self, query: str, limit: int = 10) -> List[SearchResult]:
+        """Returns up to `limit` matches of every kind whose key starts with `query`."""
+        prefix = query.strip().upper()
+        if not prefix:
+            return []
+
+        return [
+            SearchResult(kind=kind, id=value, text=text)
+            for kind, index in self.indexes.items()
+            for value, text in index.search(prefix, limit)
+        ]
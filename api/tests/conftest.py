@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+from typing import Iterator
+
+import pytest
+
+API_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules of the API import each other by name, as when it runs from the api directory.
+sys.path.insert(0, API_PATH)
+
+# database creates its engine on import, point it at SQLite instead of the Postgres of the
+# environment. Tests that use the database get their own file through the `db` fixture.
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{os.path.join(tempfile.mkdtemp(), "web1090.db")}')
+
+from database import create_database_engine, create_tables  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path: str) -> Iterator[Session]:
+    engine = create_database_engine(f'sqlite:///{tmp_path}/web1090.db')
+    create_tables(bind=engine)
+
+    with Session(bind=engine) as session:
+        yield session
+
+    engine.dispose()
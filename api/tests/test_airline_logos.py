@@ -0,0 +1,27 @@
+import os
+from types import SimpleNamespace
+
+import lookup_cache
+import pytest
+from data import ADSBData
+from lookup_cache import TTLCache
+
+
+def test_the_logo_count_is_listed_again_when_it_expires(
+    tmp_path: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    config = SimpleNamespace(
+        ac_logos_path=str(tmp_path),
+        airline_logo_count=TTLCache(max_size=1, ttl=600, negative_ttl=600),
+    )
+    data = ADSBData(None, config)  # type: ignore[arg-type]
+    open(os.path.join(tmp_path, 'KL-64.png'), 'w').close()
+    assert data.get_airline_logos() == 1
+
+    # Downloaded by another process.
+    open(os.path.join(tmp_path, 'HV-64.png'), 'w').close()
+    assert data.get_airline_logos() == 1
+
+    now = lookup_cache.time.monotonic() + 601
+    monkeypatch.setattr(lookup_cache.time, 'monotonic', lambda: now)
+    assert data.get_airline_logos() == 2
@@ -0,0 +1,17 @@
+from airports import AirportIndex
+from models import Airport
+
+
+def test_airport_index_finds_airports_by_icao_then_iata() -> None:
+    schiphol = Airport(icao='EHAM', iata='AMS', name='Schiphol')
+    heathrow = Airport(icao='EGLL', iata='LHR', name='Heathrow')
+    index = AirportIndex([schiphol, heathrow, Airport(icao='EHLE', iata=None)])
+
+    assert len(index) == 3
+    assert index.get(icao='EHAM') is schiphol
+    assert index.get(icao='XXXX', iata='LHR') is heathrow
+    assert index.get(icao='EHAM', iata='LHR') is schiphol
+    assert index.get(iata='AMS') is schiphol
+    assert index.get(icao='XXXX', iata='XXX') is None
+    assert index.get() is None
+    assert not index.is_stale()
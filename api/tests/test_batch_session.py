@@ -0,0 +1,40 @@
+from typing import List
+
+import pytest
+from batch_session import BatchSession
+from models import Route
+from sqlalchemy.orm import Session
+
+
+def get_routes(db: Session) -> List[str]:
+    db.expire_all()
+    return [route.icao for route in db.query(Route).order_by(Route.icao)]
+
+
+def test_rows_are_written_per_batch_and_committed_on_exit(db: Session) -> None:
+    with BatchSession(db, batch_size=2, flush_interval=3600) as batch:
+        batch.add(Route, [{'icao': 'KLM1'}], ['icao'])
+        assert batch.result.inserted == 0
+
+        batch.add(Route, [{'icao': 'KLM2'}], ['icao'])
+        assert batch.result.inserted == 2
+
+        batch.add(Route, [{'icao': 'KLM3'}], ['icao'])
+
+    assert batch.result.inserted == 3
+    assert get_routes(db) == ['KLM1', 'KLM2', 'KLM3']
+
+
+def test_rows_are_written_when_the_interval_passed(db: Session) -> None:
+    with BatchSession(db, batch_size=1000, flush_interval=0) as batch:
+        batch.add(Route, [{'icao': 'KLM1'}], ['icao'])
+        assert batch.result.inserted == 1
+
+
+def test_everything_is_rolled_back_when_the_block_raises(db: Session) -> None:
+    with pytest.raises(ConnectionError):
+        with BatchSession(db, batch_size=1, flush_interval=3600) as batch:
+            batch.add(Route, [{'icao': 'KLM1'}], ['icao'])
+            raise ConnectionError('upstream timed out')
+
+    assert get_routes(db) == []
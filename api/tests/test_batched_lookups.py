@@ -0,0 +1,58 @@
+from typing import Any, Iterator, List
+
+import crud
+import pytest
+from lookup_cache import aircraft_cache, route_cache
+from models import Aircraft, AircraftImage, Route
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+@pytest.fixture
+def statements(db: Session) -> Iterator[List[str]]:
+    """The SELECT statements that are sent to the database, without the cached lookups."""
+    aircraft_cache.clear()
+    route_cache.clear()
+    statements: List[str] = []
+
+    def record(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        if statement.startswith('SELECT'):
+            statements.append(statement)
+
+    engine = db.get_bind()
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_lookups_query_once_per_table(db: Session, statements: List[str]) -> None:
+    crud.bulk_upsert(db, Aircraft, [{'icao': f'48450{i}'} for i in range(5)], ['icao'])
+    crud.bulk_upsert(db, Route, [{'icao': 'KLM1'}, {'icao': 'KLM2'}], ['icao'])
+    db.add_all(
+        [
+            AircraftImage(icao='484501', number=1, image_url='b'),
+            AircraftImage(icao='484501', number=0, image_url='a'),
+            AircraftImage(icao='484502', number=0, image_url='c'),
+        ]
+    )
+    db.commit()
+    statements.clear()
+
+    aircraft = crud.get_aircraft_by_icaos(db, ['484500', '484501', '484501', 'FFFFFF'])
+    routes = crud.get_routes_by_icaos(db, ['KLM1', 'KLM3'])
+    images = crud.get_images_by_icaos(db, ['484501', '484502', '484503'])
+
+    assert sorted(aircraft) == ['484500', '484501']
+    assert list(routes) == ['KLM1']
+    assert {icao: [image.image_url for image in rows] for icao, rows in images.items()} == {
+        '484501': ['a', 'b'],
+        '484502': ['c'],
+    }
+    assert len(statements) == 3
+
+
+def test_lookups_of_no_keys_do_not_query(db: Session, statements: List[str]) -> None:
+    assert crud.get_aircraft_by_icaos(db, []) == {}
+    assert crud.get_routes_by_icaos(db, []) == {}
+    assert crud.get_images_by_icaos(db, []) == {}
+    assert statements == []
@@ -0,0 +1,100 @@
+import os
+from typing import Any, Dict, List, Optional
+
+from countries import CountryIndex, CountryResolver
+
+AC_COUNTRIES: List[Dict[str, Any]] = [
+    {'start': '480000', 'end': '487FFF', 'country': 'Netherlands'},
+    {'start': '400000', 'end': '43FFFF', 'country': 'United Kingdom'},
+    # Contains the ranges above, which come first and win.
+    {'start': '380000', 'end': '4FFFFF', 'country': 'Unassigned'},
+]
+
+
+def get_country_id(name: str) -> Optional[str]:
+    return {'Netherlands': 'NL', 'United Kingdom': 'GB'}.get(name)
+
+
+def test_country_index_looks_up_the_first_matching_range() -> None:
+    index = CountryIndex(AC_COUNTRIES, get_country_id)
+
+    assert index.lookup(0x484506) == (True, 'NL')
+    assert index.lookup(0x400001) == (True, 'GB')
+    assert index.lookup(0x488000) == (True, None)
+    assert index.lookup(0x380000) == (True, None)
+    assert index.lookup(0x4FFFFF) == (True, None)
+    assert index.lookup(0x37FFFF) == (False, None)
+    assert index.lookup(0x500000) == (False, None)
+
+
+def test_country_index_compiles_non_overlapping_intervals() -> None:
+    index = CountryIndex(AC_COUNTRIES, get_country_id)
+
+    assert all(end < start for end, start in zip(index.ends, index.starts[1:]))
+    assert len(index.starts) == 5
+
+
+def test_country_index_lookup_many() -> None:
+    index = CountryIndex(AC_COUNTRIES, get_country_id)
+
+    assert index.lookup_many(['484506', '400001', '488000', '000000', 'xyz', '']) == [
+        'NL',
+        'GB',
+        None,
+        None,
+        None,
+        None,
+    ]
+
+
+def test_country_resolver_persists_its_table(tmp_path: str) -> None:
+    path = os.path.join(tmp_path, 'country_ids.json')
+    resolver = CountryResolver(path, {})
+
+    assert resolver.resolve('Netherlands') == 'NL'
+    assert resolver.resolve('Atlantis') is None
+    resolver.save()
+
+    resolver = CountryResolver(path, {})
+    assert resolver.table == {'Atlantis': None, 'Netherlands': 'NL'}
+    assert resolver.get_unresolved() == ['Atlantis']
+    assert not resolver.dirty
+
+
+def test_country_resolver_retries_unresolved_names_in_build(tmp_path: str) -> None:
+    path = os.path.join(tmp_path, 'country_ids.json')
+    resolver = CountryResolver(path, {})
+    assert resolver.build(['Netherlands', 'Atlantis']) == 1
+
+    # Unresolved names are not searched again on lookups, only by build().
+    resolver = CountryResolver(path, {'Atlantis': 'Netherlands'})
+    assert resolver.resolve('Atlantis') is None
+    assert resolver.build(['Atlantis']) == 0
+    assert resolver.resolve('Atlantis') == 'NL'
+
+
+def test_country_resolver_retries_unresolved_names_when_the_aliases_change(
+    tmp_path: str,
+) -> None:
+    path = os.path.join(tmp_path, 'country_ids.json')
+    aliases_path = os.path.join(tmp_path, 'aliases.json')
+    with open(aliases_path, 'w') as f:
+        f.write('{}')
+
+    resolver = CountryResolver(path, {}, aliases_path)
+    resolver.build(['Netherlands', 'Atlantis'])
+
+    os.utime(aliases_path, (os.path.getmtime(path) + 1,) * 2)
+    resolver = CountryResolver(path, {'Atlantis': 'Netherlands'}, aliases_path)
+    assert resolver.table == {'Netherlands': 'NL'}
+    assert resolver.resolve('Atlantis') == 'NL'
+
+
+def test_country_resolver_saves_through_a_temporary_file(tmp_path: str) -> None:
+    path = os.path.join(tmp_path, 'country_ids.json')
+    resolver = CountryResolver(path, {})
+    resolver.resolve('Netherlands')
+    resolver.save()
+
+    assert os.listdir(tmp_path) == ['country_ids.json']
+    assert CountryResolver(path, {}).table == {'Netherlands': 'NL'}
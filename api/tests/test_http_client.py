@@ -0,0 +1,130 @@
+import io
+from typing import Any, Dict, List, Optional, Union
+
+import http_client
+import pytest
+import requests
+from http_client import HTTPClient, LatencyHistogram
+
+URL = 'https://api.example.com/v1/flights'
+
+
+def make_response(status_code: int, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(b'')
+    response.headers.update(headers or {})
+    return response
+
+
+class FakeSession:
+    def __init__(self, results: List[Union[requests.Response, Exception]]) -> None:
+        self.results = results
+        self.calls = 0
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        result = self.results[self.calls]
+        self.calls += 1
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+
+@pytest.fixture
+def delays(monkeypatch: pytest.MonkeyPatch) -> List[float]:
+    delays: List[float] = []
+    monkeypatch.setattr(http_client.time, 'sleep', delays.append)
+    return delays
+
+
+def get_client(results: List[Union[requests.Response, Exception]]) -> HTTPClient:
+    client = HTTPClient(retries=3, backoff=0.5, max_backoff=10.0)
+    _, upstream = client._get_host(URL)
+    upstream.session = FakeSession(results)  # type: ignore[assignment]
+    return client
+
+
+def get_calls(client: HTTPClient) -> int:
+    _, upstream = client._get_host(URL)
+    calls: int = upstream.session.calls  # type: ignore[attr-defined]
+    return calls
+
+
+def test_server_errors_are_retried_with_backoff(delays: List[float]) -> None:
+    client = get_client([make_response(503), make_response(502), make_response(200)])
+
+    assert client.get(URL).status_code == 200
+    assert get_calls(client) == 3
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 0.5 and 0 <= delays[1] <= 1.0
+
+    statistics = client.get_statistics()['api.example.com']
+    assert (statistics['count'], statistics['retries'], statistics['failures']) == (3, 2, 0)
+
+
+def test_the_last_response_is_returned_when_the_retries_run_out(delays: List[float]) -> None:
+    client = get_client([make_response(500)] * 4)
+
+    assert client.get(URL).status_code == 500
+    assert get_calls(client) == 4
+    assert client.get_statistics()['api.example.com']['failures'] == 1
+
+
+def test_client_errors_are_not_retried(delays: List[float]) -> None:
+    client = get_client([make_response(404)])
+
+    assert client.get(URL).status_code == 404
+    assert delays == []
+
+
+def test_rate_limits_are_retried_after_their_retry_after(delays: List[float]) -> None:
+    client = get_client([make_response(429, {'Retry-After': '2'}), make_response(200)])
+
+    assert client.get(URL).status_code == 200
+    assert delays == [2.0]
+
+
+def test_used_up_quotas_are_not_retried(delays: List[float]) -> None:
+    client = get_client([make_response(429)])
+
+    assert client.get(URL).status_code == 429
+    assert delays == []
+
+    client = get_client([make_response(429, {'Retry-After': '2'})])
+    retry_statuses = client.retry_statuses - {429}
+
+    assert client.get(URL, retry_statuses=retry_statuses).status_code == 429
+    assert delays == []
+
+
+def test_connection_errors_are_raised_when_the_retries_run_out(delays: List[float]) -> None:
+    client = get_client([requests.ConnectionError()] * 2 + [make_response(200)])
+    assert client.get(URL).status_code == 200
+
+    client = get_client([requests.Timeout()] * 2)
+    with pytest.raises(requests.Timeout):
+        client.get(URL, retries=1)
+
+    assert len(delays) == 3
+
+
+def test_delays_are_capped() -> None:
+    client = HTTPClient(backoff=0.5, max_backoff=10.0)
+
+    assert all(client._get_delay(20, None) <= 10.0 for _ in range(100))
+    assert client._get_delay(0, make_response(503, {'Retry-After': '3600'})) == 10.0
+    assert 0 <= client._get_delay(0, make_response(503, {'Retry-After': 'soon'})) <= 0.5
+
+
+def test_latency_percentiles_are_bucket_bounds() -> None:
+    histogram = LatencyHistogram()
+    for seconds in [0.01] * 90 + [0.3] * 9 + [20.0]:
+        histogram.record(seconds)
+
+    assert histogram.percentile(0.5) == 0.05
+    assert histogram.percentile(0.9) == 0.05
+    assert histogram.percentile(0.99) == 0.5
+    assert histogram.percentile(1.0) == 30.0
+    assert LatencyHistogram().percentile(0.5) == 0.0
@@ -0,0 +1,58 @@
+import threading
+from typing import List
+
+import lookup_cache
+import pytest
+from jobs import BackgroundJobs
+
+
+@pytest.fixture
+def jobs() -> BackgroundJobs:
+    return BackgroundJobs(max_workers=1, max_pending=2, failed_retry_after=60)
+
+
+def wait(jobs: BackgroundJobs) -> None:
+    jobs._executor.submit(lambda: None).result(timeout=5)
+
+
+def fail() -> None:
+    raise ConnectionError('upstream timed out')
+
+
+def test_jobs_with_the_same_key_are_queued_once(jobs: BackgroundJobs) -> None:
+    started, release = threading.Event(), threading.Event()
+    calls: List[str] = []
+
+    def block() -> None:
+        started.set()
+        release.wait(5)
+
+    assert jobs.submit('logo:KL', block)
+    started.wait(5)
+    assert not jobs.submit('logo:KL', calls.append, 'again')
+    assert jobs.submit('logo:HV', calls.append, 'HV')
+    assert not jobs.submit('logo:BA', calls.append, 'BA')
+
+    release.set()
+    wait(jobs)
+    assert calls == ['HV']
+    assert jobs.get_pending_count() == 0
+    assert jobs.submit('logo:KL', calls.append, 'KL')
+
+
+def test_failed_jobs_are_not_retried_for_a_while(
+    jobs: BackgroundJobs, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    calls: List[str] = []
+    assert jobs.submit('images:484506', fail)
+    wait(jobs)
+
+    assert not jobs.submit('images:484506', calls.append, 'retry')
+    assert jobs.submit('images:484507', calls.append, 'other')
+
+    now = lookup_cache.time.monotonic() + 61
+    monkeypatch.setattr(lookup_cache.time, 'monotonic', lambda: now)
+    assert jobs.submit('images:484506', calls.append, 'retry')
+
+    wait(jobs)
+    assert calls == ['other', 'retry']
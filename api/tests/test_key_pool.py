@@ -0,0 +1,75 @@
+import json
+import os
+from datetime import datetime
+
+import key_pool
+import pytest
+from key_pool import KeyPool
+
+
+class FakeDatetime:
+    now = datetime(2024, 1, 31, 23, 59)
+
+    @classmethod
+    def utcnow(cls) -> datetime:
+        return cls.now
+
+
+@pytest.fixture
+def path(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> str:
+    monkeypatch.setattr(key_pool, 'datetime', FakeDatetime)
+    return os.path.join(tmp_path, 'keys.json')
+
+
+def test_acquire_uses_the_key_with_the_most_requests_left(path: str) -> None:
+    pool = KeyPool(['a', 'b', 'None', ''], path, monthly_limit=2)
+
+    assert sorted(pool.acquire() or '' for _ in range(4)) == ['a', 'a', 'b', 'b']
+    assert pool.acquire() is None
+    assert pool.get_remaining() == 0
+
+
+def test_exhausted_keys_are_not_used(path: str) -> None:
+    pool = KeyPool(['a', 'b'], path, monthly_limit=100)
+    pool.mark_exhausted('a')
+
+    assert pool.get_remaining() == 100
+    assert {pool.acquire() for _ in range(10)} == {'b'}
+
+
+def test_usage_is_persisted_without_the_keys(path: str) -> None:
+    pool = KeyPool(['secret'], path, monthly_limit=100)
+    pool.acquire()
+
+    with open(path, 'r') as f:
+        content = f.read()
+
+    assert 'secret' not in content
+    assert list(json.loads(content).values()) == [
+        {'month': '2024-01', 'used': 1, 'exhausted': False}
+    ]
+    assert KeyPool(['secret'], path, monthly_limit=100).get_remaining() == 99
+
+
+def test_pools_that_share_a_file_add_up_their_counts(path: str) -> None:
+    first = KeyPool(['a'], path, monthly_limit=100)
+    second = KeyPool(['a'], path, monthly_limit=100)
+
+    first.acquire()
+    second.acquire()
+    first.acquire()
+
+    assert first.get_remaining() == second.get_remaining() == 97
+
+
+def test_quotas_reset_every_month(path: str) -> None:
+    pool = KeyPool(['a', 'b'], path, monthly_limit=1)
+    pool.acquire()
+    pool.mark_exhausted('b')
+    assert pool.acquire() is None
+
+    FakeDatetime.now = datetime(2024, 2, 1, 0, 0)
+    try:
+        assert pool.get_remaining() == 2
+    finally:
+        FakeDatetime.now = datetime(2024, 1, 31, 23, 59)
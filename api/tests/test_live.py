@@ -0,0 +1,162 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+from live import AircraftFields, BoundingBox, LiveSnapshot, Subscriber
+
+
+class FakeDump1090:
+    def __init__(self) -> None:
+        self.responses: List[SimpleNamespace] = []
+
+    async def get_live_flights(self) -> SimpleNamespace:
+        return self.responses.pop(0)
+
+
+def build(live_flights: SimpleNamespace, seq: int) -> Tuple[AircraftFields, bytes]:
+    """LiveSnapshot._build without enriching the aircraft from the database."""
+    aircraft: AircraftFields = live_flights.aircraft
+    return aircraft, json.dumps({'seq': seq, 'aircraft': list(aircraft.values())}).encode()
+
+
+@pytest.fixture
+def snapshot(monkeypatch: pytest.MonkeyPatch) -> LiveSnapshot:
+    snapshot = LiveSnapshot(SimpleNamespace(dump1090=FakeDump1090()))
+    monkeypatch.setattr(snapshot, '_build', build)
+    return snapshot
+
+
+def refresh(snapshot: LiveSnapshot, now: float, aircraft: List[Dict[str, Any]]) -> None:
+    async def run() -> None:
+        snapshot._ready = asyncio.Event()
+        await snapshot.refresh()
+
+    live_flights = SimpleNamespace(now=now, aircraft={fields['hex']: fields for fields in aircraft})
+    snapshot.config.dump1090.responses.append(live_flights)
+    asyncio.run(run())
+
+
+def parse(body: Optional[bytes]) -> Dict[str, Any]:
+    assert body is not None
+    result: Dict[str, Any] = json.loads(body)
+    return result
+
+
+def test_refresh_builds_a_new_snapshot(snapshot: LiveSnapshot) -> None:
+    refresh(snapshot, 1.0, [{'hex': 'a', 'lat': 52.0, 'lon': 4.0}, {'hex': 'b'}])
+
+    assert snapshot.seq == 1
+    assert snapshot.aircraft_count == 2
+    assert [fields['hex'] for fields in parse(asyncio.run(snapshot.get_body()))['aircraft']] == [
+        'a',
+        'b',
+    ]
+
+
+def test_unchanged_aircraft_json_is_not_a_new_snapshot(snapshot: LiveSnapshot) -> None:
+    refresh(snapshot, 1.0, [{'hex': 'a', 'lat': 52.0, 'lon': 4.0}])
+    refresh(snapshot, 1.0, [{'hex': 'a', 'lat': 52.1, 'lon': 4.0}])
+
+    assert snapshot.seq == 1
+    assert snapshot.aircraft_count == 1
+
+
+def test_get_body_does_not_wait_without_a_producer(snapshot: LiveSnapshot) -> None:
+    assert asyncio.run(snapshot.get_body()) is None
+
+
+def test_tokens_include_the_epoch(snapshot: LiveSnapshot) -> None:
+    other = LiveSnapshot(SimpleNamespace())
+    token = snapshot.get_token(7)
+
+    assert snapshot.parse_token(token) == 7
+    assert other.parse_token(token) is None
+    assert snapshot.parse_token('7') is None
+    assert snapshot.parse_token(f'{snapshot.epoch}-x') is None
+    assert snapshot.parse_token(None) is None
+    assert snapshot.get_etag() == f'"{snapshot.epoch}-0"'
+
+
+def test_delta_reports_added_changed_and_removed_aircraft(snapshot: LiveSnapshot) -> None:
+    refresh(snapshot, 1.0, [{'hex': 'a', 'lat': 52.0, 'lon': 4.0}, {'hex': 'b', 'lat': 1.0}])
+    refresh(snapshot, 2.0, [{'hex': 'a', 'lat': 52.1, 'lon': 4.0}, {'hex': 'c', 'lat': 2.0}])
+
+    delta = parse(snapshot.get_delta(1))
+    assert delta['seq'] == snapshot.get_token(2)
+    assert delta['since'] == snapshot.get_token(1)
+    assert delta['added'] == [{'hex': 'c', 'lat': 2.0}]
+    assert delta['changed'] == {'a': {'lat': 52.1}}
+    assert delta['removed'] == ['b']
+
+
+def test_delta_of_an_unknown_snapshot_is_none(snapshot: LiveSnapshot) -> None:
+    refresh(snapshot, 1.0, [{'hex': 'a'}])
+
+    assert snapshot.get_delta(1) is None
+    assert snapshot.get_delta(5) is None
+
+    for now in range(2, snapshot.history_size + 3):
+        refresh(snapshot, float(now), [{'hex': 'a'}])
+
+    assert snapshot.get_delta(1) is None
+    assert snapshot.get_delta(snapshot.seq - 1) is not None
+
+
+def test_bounding_box_contains() -> None:
+    bbox = BoundingBox(lat_min=52.0, lon_min=4.0, lat_max=53.0, lon_max=5.0)
+
+    assert bbox.contains({'lat': 52.3, 'lon': 4.76})
+    assert bbox.contains({'lat': 52.0, 'lon': 5.0})
+    assert not bbox.contains({'lat': 51.9, 'lon': 4.76})
+    assert not bbox.contains({'lat': 52.3, 'lon': None})
+    assert not bbox.contains({})
+
+
+def test_aircraft_that_leave_the_bounding_box_are_removed(snapshot: LiveSnapshot) -> None:
+    bbox = BoundingBox(lat_min=52.0, lon_min=4.0, lat_max=53.0, lon_max=5.0)
+    refresh(snapshot, 1.0, [{'hex': 'a', 'lat': 52.5, 'lon': 4.5}, {'hex': 'b'}])
+    refresh(snapshot, 2.0, [{'hex': 'a', 'lat': 53.5, 'lon': 4.5}])
+
+    assert [fields['hex'] for fields in parse(snapshot.get_snapshot(bbox))['aircraft']] == []
+    assert parse(snapshot.get_delta(1, bbox))['removed'] == ['a']
+
+
+def test_slow_subscribers_are_disconnected(snapshot: LiveSnapshot) -> None:
+    async def run() -> Tuple[List[int], bool]:
+        subscriber = snapshot.subscribe()
+        assert subscriber is not None
+
+        for seq in range(snapshot.max_pending + 1):
+            snapshot.seq = seq
+            snapshot._publish()
+
+        return [subscriber.queue.get_nowait()], subscriber in snapshot._subscribers
+
+    assert asyncio.run(run()) == ([Subscriber.disconnect], False)
+
+
+def test_stream_starts_with_the_snapshot_and_frees_its_slot(snapshot: LiveSnapshot) -> None:
+    refresh(snapshot, 1.0, [{'hex': 'a'}])
+    stream = snapshot.stream(None, None)
+
+    async def run() -> Tuple[bytes, int]:
+        event = await stream.__anext__()
+        subscribers = len(snapshot._subscribers)
+        await stream.aclose()  # type: ignore[attr-defined]
+        return event, subscribers
+
+    event, subscribers = asyncio.run(run())
+    assert event.startswith(f'id: {snapshot.get_token(1)}\ndata: '.encode())
+    assert subscribers == 1
+    assert len(snapshot._subscribers) == 0
+
+
+def test_stream_asks_to_retry_later_when_full(snapshot: LiveSnapshot) -> None:
+    snapshot.max_subscribers = 0
+
+    async def run() -> List[bytes]:
+        return [event async for event in snapshot.stream(None, None)]
+
+    assert asyncio.run(run()) == [b'retry: 30000\n\n']
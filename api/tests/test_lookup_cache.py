@@ -0,0 +1,93 @@
+import crud
+import lookup_cache
+import pytest
+from lookup_cache import TTLCache
+from models import Aircraft
+from sqlalchemy.orm import Session
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(lookup_cache.time, 'monotonic', clock)
+    return clock
+
+
+def test_lookup_counts_hits_and_misses() -> None:
+    cache: TTLCache[str] = TTLCache(max_size=10, ttl=60, negative_ttl=10)
+
+    assert cache.lookup('KLM1') == (False, None)
+    cache.put('KLM1', 'route')
+    assert cache.lookup('KLM1') == (True, 'route')
+    assert cache.get_statistics() == {'size': 1, 'max_size': 10, 'hits': 1, 'misses': 1}
+
+
+def test_entries_expire_after_their_ttl(clock: Clock) -> None:
+    cache: TTLCache[str] = TTLCache(max_size=10, ttl=60, negative_ttl=10)
+    cache.put('KLM1', 'route')
+    cache.put('KLM2', None)
+
+    clock.now += 30
+    assert cache.lookup('KLM1') == (True, 'route')
+    assert cache.lookup('KLM2') == (False, None)
+    assert len(cache) == 1
+
+    clock.now += 31
+    assert cache.lookup('KLM1') == (False, None)
+    assert len(cache) == 0
+
+
+def test_negative_entries_are_found(clock: Clock) -> None:
+    cache: TTLCache[str] = TTLCache(max_size=10, ttl=60, negative_ttl=10)
+    cache.put('KLM1', None)
+
+    clock.now += 5
+    assert cache.lookup('KLM1') == (True, None)
+
+
+def test_evicts_the_least_recently_used_entry() -> None:
+    cache: TTLCache[int] = TTLCache(max_size=2, ttl=60, negative_ttl=10)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.lookup('a')
+    cache.put('c', 3)
+
+    assert cache.lookup('a') == (True, 1)
+    assert cache.lookup('b') == (False, None)
+    assert cache.lookup('c') == (True, 3)
+
+
+def test_invalidate_and_clear() -> None:
+    cache: TTLCache[int] = TTLCache(max_size=10, ttl=60, negative_ttl=10)
+    cache.put('a', 1)
+    cache.put('b', 2)
+
+    cache.invalidate('a')
+    cache.invalidate('unknown')
+    assert cache.lookup('a') == (False, None)
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_cached_rows_are_not_changed_by_writes(db: Session) -> None:
+    lookup_cache.aircraft_cache.clear()
+    crud.bulk_upsert(db, Aircraft, [{'icao': '484506'}], ['icao'])
+    cached = crud.get_aircraft_cached(db, '484506')
+    assert cached is not None and not cached.has_no_images
+
+    crud.set_aircraft_has_no_images(db, cached)
+
+    assert not cached.has_no_images
+    assert lookup_cache.aircraft_cache.lookup('484506') == (False, None)
+
+    aircraft = crud.get_aircraft_cached(db, '484506')
+    assert aircraft is not None and aircraft.has_no_images
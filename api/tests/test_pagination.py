@@ -0,0 +1,86 @@
+from typing import Any, Dict, List
+
+import crud
+import pytest
+from models import Aircraft, Route
+from sqlalchemy.orm import Session
+
+AIRPORTS = [('EHAM', 'AMS'), ('EGLL', 'LHR'), ('KJFK', 'JFK')]
+
+
+@pytest.fixture
+def routes(db: Session) -> List[Dict[str, Any]]:
+    rows = []
+    for i in range(60):
+        dep_icao, dep_iata = AIRPORTS[i % 3]
+        arr_icao, arr_iata = AIRPORTS[(i + 1) % 3]
+        rows.append(
+            {
+                'icao': f'KLM{i:03}' if i % 2 else f'BAW{i:03}',
+                'airline_icao': 'KLM' if i % 2 else 'BAW',
+                'airline_iata': 'KL' if i % 2 else 'BA',
+                'dep_icao': dep_icao,
+                'dep_iata': dep_iata,
+                'arr_icao': arr_icao,
+                'arr_iata': arr_iata,
+            }
+        )
+
+    crud.bulk_upsert(db, Route, rows, ['icao'])
+    return sorted(rows, key=lambda row: str(row['icao']))
+
+
+def get_all_pages(db: Session, limit: int, **filters: Any) -> List[str]:
+    icaos: List[str] = []
+    after = None
+
+    while True:
+        page = crud.get_routes_paginated(db, 0, limit, after, **filters)
+        icaos += [route.icao for route in page]
+
+        if len(page) < limit:
+            return icaos
+
+        after = page[-1].icao
+
+
+def test_keyset_pages_return_every_route_once(db: Session, routes: List[Dict[str, Any]]) -> None:
+    assert get_all_pages(db, 7) == [row['icao'] for row in routes]
+
+
+def test_skip_and_after(db: Session, routes: List[Dict[str, Any]]) -> None:
+    icaos = [row['icao'] for row in routes]
+
+    assert [route.icao for route in crud.get_routes_paginated(db, 5, 3)] == icaos[5:8]
+    assert [route.icao for route in crud.get_routes_paginated(db, 2, 3, icaos[10])] == icaos[13:16]
+
+
+@pytest.mark.parametrize('airline', ['KLM', 'KL'])
+def test_airline_filter(db: Session, routes: List[Dict[str, Any]], airline: str) -> None:
+    assert get_all_pages(db, 4, airline=airline) == [
+        row['icao'] for row in routes if row['airline_icao'] == 'KLM'
+    ]
+
+
+@pytest.mark.parametrize('airport', ['EHAM', 'AMS'])
+def test_airport_filter_matches_departures_and_arrivals(
+    db: Session, routes: List[Dict[str, Any]], airport: str
+) -> None:
+    expected = [row['icao'] for row in routes if 'EHAM' in (row['dep_icao'], row['arr_icao'])]
+
+    assert get_all_pages(db, 4, airport=airport) == expected
+    assert [
+        route.icao for route in crud.get_routes_paginated(db, 3, 5, expected[2], airport=airport)
+    ] == expected[6:11]
+    assert get_all_pages(db, 4, airline='KL', airport=airport) == [
+        icao for icao in expected if icao.startswith('KLM')
+    ]
+
+
+def test_iterate_table(db: Session, routes: List[Dict[str, Any]]) -> None:
+    crud.bulk_upsert(db, Aircraft, [{'icao': f'{i:06X}'} for i in range(25)], ['icao'])
+
+    assert [route.icao for route in crud.iterate_table(db, Route, 10)] == [
+        row['icao'] for row in routes
+    ]
+    assert len(list(crud.iterate_table(db, Aircraft, 5))) == 25
@@ -0,0 +1,56 @@
+import datetime as dt
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import pytest
+import schiphol
+from responses import DUMP1090Response
+from schiphol import Schiphol
+
+
+class FrozenDatetime(dt.datetime):
+    frozen_minute = 0
+
+    @classmethod
+    def now(cls, tz: Optional[dt.tzinfo] = None) -> 'FrozenDatetime':
+        return cls(2024, 5, 1, 12, cls.frozen_minute, 30, tzinfo=dt.timezone.utc)
+
+
+@pytest.fixture
+def requests(monkeypatch: pytest.MonkeyPatch) -> List[Dict[str, Any]]:
+    schiphol.response_cache.clear()
+    requests: List[Dict[str, Any]] = []
+
+    def send(self: Schiphol, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        requests.append(params)
+        return {'flights': []}
+
+    monkeypatch.setattr(Schiphol, '_send_uncached_request', send)
+    monkeypatch.setattr(
+        schiphol, 'dt', SimpleNamespace(datetime=FrozenDatetime, timedelta=dt.timedelta)
+    )
+    return requests
+
+
+def get_schiphol() -> Schiphol:
+    live_flights = DUMP1090Response(now=0, aircraft=[])
+    return Schiphol(SimpleNamespace(db=None, get_live_flights=lambda: live_flights))
+
+
+def test_nearby_flights_are_reused_within_their_window(requests: List[Dict[str, Any]]) -> None:
+    FrozenDatetime.frozen_minute = 1
+    assert get_schiphol().get_nearby_flights() == []
+    assert len(requests) == 2
+
+    FrozenDatetime.frozen_minute = 4
+    get_schiphol().get_nearby_flights()
+    assert len(requests) == 2
+
+    FrozenDatetime.frozen_minute = 5
+    get_schiphol().get_nearby_flights()
+    assert len(requests) == 4
+
+
+def test_no_nearby_flights_are_stored_without_an_error(requests: List[Dict[str, Any]]) -> None:
+    get_schiphol().store_missing_flight_data()
+    assert len(requests) == 2
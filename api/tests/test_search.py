@@ -0,0 +1,75 @@
+import crud
+from models import Aircraft, Airline
+from search import PrefixIndex, SearchIndex, SearchKind
+from sqlalchemy.orm import Session
+
+
+def test_prefix_index_returns_the_matches_in_order() -> None:
+    index = PrefixIndex([('KLM12', 'KLM12', 'KLM12'), ('KLM1', 'KLM1', 'KLM1'), ('EZY1', 'E', 'E')])
+
+    assert index.search('KLM', 10) == [('KLM1', 'KLM1'), ('KLM12', 'KLM12')]
+    assert index.search('KLM', 1) == [('KLM1', 'KLM1')]
+    assert index.search('KLM12', 10) == [('KLM12', 'KLM12')]
+    assert index.search('TRA', 10) == []
+    assert index.search('ZZZ', 10) == []
+
+
+def get_index() -> SearchIndex:
+    return SearchIndex(
+        routes=['KLM1', 'KLM12', 'TRA5'],
+        aircraft=[('484506', 'PH-BXA'), ('484507', None)],
+        airlines=[('KL', 'KLM Royal Dutch Airlines'), ('HV', 'Transavia'), ('XX', None)],
+    )
+
+
+def test_search_index_searches_every_kind() -> None:
+    results = get_index().search(' kl ')
+
+    assert [(result.kind, result.id, result.text) for result in results] == [
+        (SearchKind.route, 'KLM1', 'KLM1'),
+        (SearchKind.route, 'KLM12', 'KLM12'),
+        (SearchKind.airline, 'KL', 'KLM Royal Dutch Airlines'),
+    ]
+    assert get_index().search('  ') == []
+
+
+def test_registrations_are_found_with_and_without_their_dash() -> None:
+    index = get_index()
+
+    for query in ['PH-B', 'phbx', 'PHBXA']:
+        assert [(result.id, result.text) for result in index.search(query)] == [
+            ('484506', 'PH-BXA')
+        ]
+
+    assert [result.id for result in index.search('4845')] == ['484506', '484507']
+    assert len(index) == 3 + 4 + 2
+
+
+def test_search_index_becomes_stale() -> None:
+    index = get_index()
+    assert not index.is_stale()
+
+    index.built_at -= SearchIndex.max_age + 1
+    assert index.is_stale()
+
+
+def test_prefix_queries_return_the_first_matches_in_order(db: Session) -> None:
+    crud.bulk_upsert(
+        db,
+        Aircraft,
+        [{'icao': '484507'}, {'icao': '4845AB'}, {'icao': '484506'}, {'icao': '3C6444'}],
+        ['icao'],
+    )
+    db.add_all(
+        [
+            Airline(iata_code='KL', airline_name='KLM Royal Dutch Airlines'),
+            Airline(iata_code='WA', airline_name='KLM Cityhopper'),
+        ]
+    )
+    db.commit()
+
+    _, aircraft, _ = crud._select_by_prefix('4845', 2)
+    assert [icao for icao, _ in db.execute(aircraft)] == ['484506', '484507']
+
+    _, _, airlines = crud._select_by_prefix('KLM', 10)
+    assert [iata for iata, _ in db.execute(airlines)] == ['WA', 'KL']
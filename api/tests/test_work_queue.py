@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import crud
+from models import Aircraft, Route, WorkItem, WorkKind, WorkStatus
+from sqlalchemy.orm import Session
+
+
+def get_items(db: Session) -> List[Tuple[str, str, int, Optional[str]]]:
+    db.expire_all()
+    return [
+        (item.key, item.status, item.attempts, item.registration)
+        for item in db.query(WorkItem).order_by(WorkItem.key)
+    ]
+
+
+def attempt(db: Session, keys: List[str], times: int = 1) -> None:
+    for _ in range(times):
+        crud.resolve_work_items(db)
+        crud.record_work_attempts(db, WorkKind.route, keys, 'test')
+
+
+def test_enqueue_is_idempotent(db: Session) -> None:
+    crud.enqueue_work_items(db, WorkKind.route, [('KLM1', None), ('KLM2', 'PH-BXA')])
+    crud.enqueue_work_items(db, WorkKind.route, [('KLM1', None), ('KLM1', None)])
+
+    assert get_items(db) == [
+        ('KLM1', WorkStatus.pending, 0, None),
+        ('KLM2', WorkStatus.pending, 0, 'PH-BXA'),
+    ]
+    assert crud.get_pending_work_count(db, WorkKind.route) == 2
+    assert crud.get_pending_work_count(db, WorkKind.aircraft) == 0
+
+
+def test_enqueue_fills_in_a_missing_registration(db: Session) -> None:
+    crud.enqueue_work_items(db, WorkKind.route, [('KLM1', None), ('KLM2', 'PH-BXA')])
+    crud.enqueue_work_items(db, WorkKind.route, [('KLM1', 'PH-BXB'), ('KLM2', 'PH-BXC')])
+
+    assert [registration for *_, registration in get_items(db)] == ['PH-BXB', 'PH-BXA']
+    assert [
+        item.key for item in crud.get_pending_work_items(db, WorkKind.route, with_registration=True)
+    ] == ['KLM1', 'KLM2']
+
+
+def test_resolved_items_are_done_and_not_counted(db: Session) -> None:
+    crud.enqueue_work_items(db, WorkKind.route, [('KLM1', None), ('KLM2', None)])
+    crud.bulk_upsert(db, Route, [{'icao': 'KLM1'}], ['icao'])
+
+    attempt(db, ['KLM1', 'KLM2'])
+
+    assert get_items(db) == [
+        ('KLM1', WorkStatus.done, 0, None),
+        ('KLM2', WorkStatus.pending, 1, None),
+    ]
+
+
+def test_aircraft_are_only_done_when_complete(db: Session) -> None:
+    crud.enqueue_work_items(db, WorkKind.aircraft, [('484506', None), ('484507', None)])
+    crud.bulk_upsert(
+        db,
+        Aircraft,
+        [
+            {'icao': '484506', 'registration': 'PH-BXA', 'aircrafttype': 'B738'},
+            {'icao': '484507', 'registration': 'PH-BXB', 'aircrafttype': None},
+        ],
+        ['icao'],
+    )
+
+    crud.resolve_work_items(db)
+
+    assert [status for _, status, *_ in get_items(db)] == [WorkStatus.done, WorkStatus.pending]
+
+
+def test_items_fail_after_the_maximum_number_of_attempts(db: Session) -> None:
+    crud.enqueue_work_items(db, WorkKind.route, [('KLM1', None)])
+
+    attempt(db, ['KLM1'], crud.MAX_WORK_ATTEMPTS - 1)
+    assert get_items(db) == [('KLM1', WorkStatus.pending, crud.MAX_WORK_ATTEMPTS - 1, None)]
+
+    attempt(db, ['KLM1'], 2)
+    assert get_items(db) == [('KLM1', WorkStatus.failed, crud.MAX_WORK_ATTEMPTS, None)]
+    assert crud.get_pending_work_items(db, WorkKind.route) == []
+
+
+def test_failed_items_are_retried_when_enqueued_after_a_while(db: Session) -> None:
+    crud.enqueue_work_items(db, WorkKind.route, [('KLM1', None)])
+    attempt(db, ['KLM1'], crud.MAX_WORK_ATTEMPTS)
+
+    crud.enqueue_work_items(db, WorkKind.route, [('KLM1', None)])
+    assert get_items(db) == [('KLM1', WorkStatus.failed, crud.MAX_WORK_ATTEMPTS, None)]
+
+    attempted_at = datetime.utcnow() - crud.FAILED_WORK_RETRY_AFTER - timedelta(minutes=1)
+    db.query(WorkItem).update({WorkItem.attempted_at: attempted_at})
+    db.commit()
+
+    crud.enqueue_work_items(db, WorkKind.route, [('KLM1', 'PH-BXA')])
+    assert get_items(db) == [('KLM1', WorkStatus.pending, 0, 'PH-BXA')]
+
+
+def test_pending_items_with_the_fewest_attempts_come_first(db: Session) -> None:
+    crud.enqueue_work_items(db, WorkKind.route, [('KLM1', None)])
+    crud.enqueue_work_items(db, WorkKind.route, [('KLM2', None)])
+    attempt(db, ['KLM1'])
+
+    assert [item.key for item in crud.get_pending_work_items(db, WorkKind.route)] == [
+        'KLM2',
+        'KLM1',
+    ]
+    assert len(crud.get_pending_work_items(db, WorkKind.route, limit=1)) == 1
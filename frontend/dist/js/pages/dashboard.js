@@ -49,7 +49,8 @@ $(function () {
     var markers = {}
     var marker_urls = {}
     var active_icao = null;
-    var flight_data = {};
+    var flight_data = [];
+    var flight_seq = null;
 
     function UpdateAircraftTypes(aircrafttypes) {
         var colors = [];
@@ -293,9 +294,35 @@ $(function () {
         if ($('#world-map').length < 1)
             return;
 
-        fetch(api_domain + 'liveflights')
-            .then(response => response.json())
-            .then(data => {flight_data = data.aircraft; UpdateLiveFlights()});
+        const url = flight_seq === null ? 'liveflights' : `liveflights?since=${encodeURIComponent(flight_seq)}`;
+
+        fetch(api_domain + url)
+            .then(response => response.status == 304 ? null : response.json())
+            .then(data => {
+                if (data === null)
+                    return;
+
+                ApplyLiveFlights(data);
+                UpdateLiveFlights();
+            });
+    }
+
+    function ApplyLiveFlights(data) {
+        flight_seq = data.seq;
+
+        // Full snapshot, sent on the first request or when our seq is too old.
+        if (data.aircraft !== undefined) {
+            flight_data = data.aircraft;
+            return;
+        }
+
+        const removed = new Set(data.removed);
+        flight_data = flight_data.filter(flight => !removed.has(flight.hex));
+        flight_data.forEach(flight => {
+            if (flight.hex in data.changed)
+                Object.assign(flight, data.changed[flight.hex]);
+        });
+        flight_data = flight_data.concat(data.added);
     }
 
     function RefreshStatistics() {